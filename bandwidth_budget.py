@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+多进程共享的下载带宽/连接预算
+同一台机器上的多个下载进程在一个加锁的状态文件中登记心跳，按活跃进程数平分总带宽和总连接数
+每个进程在本地按自己的份额限速，只有定期刷新份额时才读写状态文件
+刷新在后台线程中进行，其它进程持有文件锁时不会阻塞下载协程所在的事件循环
+
+iwara_batch_downloader.py 通过环境变量配置（batch_dl.sh 的 --bandwidth / --connections 会设置它们）：
+
+    IWARA_BANDWIDTH_LIMIT=80 IWARA_CONNECTION_LIMIT=32 python iwara_batch_downloader.py <目录>
+
+在协程中使用：
+
+    budget = BandwidthBudget('/tmp/iwara_download_budget.json', rate=80 * 1024 * 1024, connections=32)
+    async with budget.connection():
+        ...
+        await budget.consume(len(chunk))
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+HEARTBEAT_INTERVAL = 2  # 刷新心跳和份额的间隔（秒）
+PROCESS_TIMEOUT = 10  # 超过该秒数没有心跳的进程视为已退出
+
+class BandwidthBudget:
+    """按活跃进程数平分的带宽（字节/秒）和连接数预算，0 表示不限制"""
+
+    def __init__(self, path, rate=0, connections=0):
+        self.path = path
+        self.rate = rate
+        self.connections = connections
+        self.pid = str(os.getpid())
+        self.share_rate = rate
+        self.share_connections = connections
+        self.active_processes = 1
+        self.tokens = 0.0
+        self.last_fill = time.monotonic()
+        self.lock = threading.Lock()
+        self.active_connections = 0
+        self.condition = None
+        self.refresh()
+        self.stopped = threading.Event()
+        self.heartbeat = threading.Thread(target=self._heartbeat_loop, name='bandwidth-budget', daemon=True)
+        self.heartbeat.start()
+
+    def _heartbeat_loop(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            self.refresh()
+
+    def _update_state(self, update):
+        """在文件锁内读取、修改并写回进程表，返回修改后的进程表"""
+        with open(self.path, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    processes = json.load(f)
+                except ValueError:
+                    processes = {}
+                now = time.time()
+                processes = {pid: seen for pid, seen in processes.items() if now - seen < PROCESS_TIMEOUT}
+                update(processes)
+                f.seek(0)
+                f.truncate()
+                json.dump(processes, f)
+                f.flush()
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return processes
+
+    def refresh(self):
+        """登记心跳，并按当前活跃进程数重新计算本进程的份额（由后台线程定期调用）"""
+        now = time.time()
+        try:
+            # 文件锁可能要等其它进程，等待期间不持有 self.lock，不影响 consume
+            processes = self._update_state(lambda p: p.__setitem__(self.pid, now))
+        except OSError as e:
+            # 状态文件不可用时保留上一次的份额
+            print(f"[带宽] 无法更新共享预算: {e}")
+            return
+        with self.lock:
+            self.active_processes = max(1, len(processes))
+            self.share_rate = self.rate / self.active_processes if self.rate else 0
+            self.share_connections = max(1, self.connections // self.active_processes) if self.connections else 0
+
+    def current_rate(self):
+        """本进程当前的带宽份额（字节/秒），0 表示不限制"""
+        return self.share_rate
+
+    async def consume(self, nbytes):
+        """消耗 nbytes 的带宽，超出份额时等待（令牌桶，最多积累 1 秒的额度）"""
+        with self.lock:
+            rate = self.share_rate
+            if not rate:
+                return
+            now = time.monotonic()
+            self.tokens = min(rate, self.tokens + (now - self.last_fill) * rate)
+            self.last_fill = now
+            # 允许透支，透支部分按份额折算成等待时间
+            self.tokens -= nbytes
+            debt = -self.tokens
+        if debt > 0:
+            await asyncio.sleep(debt / rate)
+
+    @asynccontextmanager
+    async def connection(self):
+        """占用一个连接名额，超过本进程份额时等待"""
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(
+                lambda: not self.share_connections or self.active_connections < self.share_connections
+            )
+            self.active_connections += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.active_connections -= 1
+                self.condition.notify_all()
+
+    def close(self):
+        """注销本进程，其它进程在下次刷新时分到更多份额"""
+        self.stopped.set()
+        self.heartbeat.join()
+        try:
+            self._update_state(lambda p: p.pop(self.pid, None))
+        except OSError:
+            pass
@@ -15,6 +15,8 @@ DEFAULT_END_DATE="2025-03"
 # 初始化变量
 START_DATE=""
 END_DATE=""
+WORKERS=4
+ORDER="name"
 
 # 解析命令行参数
 for arg in "$@"; do
@@ -27,15 +29,36 @@ for arg in "$@"; do
             END_DATE="${arg#*=}"
             shift
             ;;
+        --workers=*)
+            WORKERS="${arg#*=}"
+            shift
+            ;;
+        --order=*)
+            ORDER="${arg#*=}"
+            shift
+            ;;
+        --bandwidth=*)
+            export IWARA_BANDWIDTH_LIMIT="${arg#*=}"
+            shift
+            ;;
+        --connections=*)
+            export IWARA_CONNECTION_LIMIT="${arg#*=}"
+            shift
+            ;;
         --help|-h)
             echo "使用方法: $0 [选项]"
             echo "选项:"
             echo "  --start=YYYY-MM    设置开始日期（较早的日期，默认: $DEFAULT_START_DATE）"
             echo "  --end=YYYY-MM      设置结束日期（较晚的日期，默认: $DEFAULT_END_DATE）"
+            echo "  --workers=N        同时运行的下载进程数（默认: 4）"
+            echo "  --order=ORDER      下载顺序: name/smallest/popular/newest/oldest/mixed（默认: name）"
+            echo "  --bandwidth=MB/s   所有下载进程共享的总带宽（默认不限制）"
+            echo "  --connections=N    所有下载进程共享的总连接数（默认不限制）"
             echo "  --help, -h         显示此帮助信息"
             echo ""
             echo "示例:"
             echo "  $0 --start=2024-03 --end=2025-06"
+            echo "  $0 --start=2024-03 --end=2025-06 --bandwidth=80 --connections=32"
             echo ""
             echo "注意：脚本将按时间倒序处理（从新到旧）"
             exit 0
@@ -98,103 +121,18 @@ pip install playwright
 playwright install chromium
 
 echo "开始批量下载任务..."
-echo "从 $START_DATE 到 $END_DATE（按时间倒序处理）"
+echo "从 $START_DATE 到 $END_DATE（按时间倒序处理，$WORKERS 个工作进程）"
 echo "================================"
 
-# 生成所有的年月组合（从结束日期倒推到开始日期）
-dates=()
-
-# 从结束日期开始倒推
-current_year=$END_YEAR
-current_month=$((10#$END_MONTH))
-
-# 循环生成日期，直到达到开始日期
-while true; do
-    # 格式化月份（确保是两位数）
-    formatted_month=$(printf "%02d" $current_month)
-    current_date="$current_year-$formatted_month"
-    
-    # 添加当前日期
-    dates+=("$current_date")
-    
-    # 检查是否达到开始日期
-    if [ $current_year -eq $START_YEAR ] && [ $current_month -eq $((10#$START_MONTH)) ]; then
-        break
-    fi
-    
-    # 月份递减
-    current_month=$((current_month - 1))
-    
-    # 如果月份小于1，则年份递减，月份重置为12
-    if [ $current_month -lt 1 ]; then
-        current_month=12
-        current_year=$((current_year - 1))
-        
-        # 额外的安全检查
-        if [ $current_year -lt $START_YEAR ]; then
-            echo "错误：日期计算出现问题"
-            exit 1
-        fi
-    fi
-done
-
-# 显示生成的日期范围
-echo "将处理以下日期（从新到旧）："
-echo "${dates[@]}"
-echo ""
-
-# 计数器
-total=${#dates[@]}
-completed=0
-group_num=1
-
-# 按4个一组处理
-for ((i=0; i<${#dates[@]}; i+=4)); do
-    echo ""
-    echo "执行第 $group_num 组任务..."
-    echo "--------------------------------"
-    
-    # 存储当前组的进程ID
-    pids=()
-    
-    # 启动当前组的任务（最多4个）
-    for ((j=0; j<4 && i+j<${#dates[@]}; j++)); do
-        date=${dates[$((i+j))]}
-        dir="/data2/classification/$date"
-        
-        echo "启动任务: $date"
-        python iwara_batch_downloader.py "$dir" "$date" &
-        pids+=($!)
-    done
-    
-    # 等待当前组的所有任务完成
-    echo ""
-    echo "等待第 $group_num 组任务完成..."
-    
-    for pid in ${pids[@]}; do
-        wait $pid
-        status=$?
-        if [ $status -eq 0 ]; then
-            ((completed++))
-            echo "进程 $pid 完成 (成功)"
-        else
-            echo "进程 $pid 完成 (错误代码: $status)"
-        fi
-    done
-    
-    echo "第 $group_num 组任务完成！已完成: $completed/$total"
-    echo "================================"
-    
-    ((group_num++))
-    
-    # 如果不是最后一组，稍作暂停
-    if [ $((i+4)) -lt ${#dates[@]} ]; then
-        echo "等待 5 秒后继续下一组..."
-        sleep 5
-    fi
-done
+# 所有月份的视频登记到同一个任务队列，工作进程各自领取任务，不再按 4 个月一组等待
+python batch_download.py --start="$START_DATE" --end="$END_DATE" --workers="$WORKERS" --order="$ORDER"
+status=$?
 
 echo ""
-echo "所有任务执行完成！"
-echo "总计完成: $completed/$total"
-echo "================================"
\ No newline at end of file
+if [ $status -eq 0 ]; then
+    echo "所有任务执行完成！"
+else
+    echo "调度器异常退出 (错误代码: $status)"
+fi
+echo "================================"
+exit $status
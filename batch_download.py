@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+多进程批量下载调度器 - 替代 batch_dl.sh 中"每 4 个月一组、等最慢的月份结束"的方式
+把日期范围内所有月份目录中的视频 JSON 登记到一个 SQLite 任务队列，N 个工作进程各自从队列中领取任务，
+大月份不会让其它进程空等，直到整个范围下载完
+
+使用方法：
+python batch_download.py --start=2014-02 --end=2025-03 [--workers=4] [--source=/data2/classification] [--output=.]
+                         [--order=smallest]
+
+中断后重新运行同样的命令即可继续，已完成的任务不会重复处理
+任务状态、失败原因保存在任务库（job_store.JobStore）中
+"""
+
+import argparse
+import glob
+import multiprocessing
+import os
+import time
+
+from job_store import ACTIVE_STATES, QUEUE_ORDERS, JobStore
+
+DEFAULT_SOURCE_DIR = '/data2/classification'
+DEFAULT_QUEUE_FILE = 'download_queue.sqlite'
+MONITOR_INTERVAL = 10  # 打印整体进度的间隔（秒）
+FAST_FAILURE_SECONDS = 120  # 启动后这么快就异常退出的算作快速失败
+MAX_FAST_FAILURES = 3  # 同一个工作进程连续快速失败这么多次后不再重启
+RESTART_BACKOFF = 10  # 重启前等待的秒数，每次连续快速失败后加倍
+
+def month_range(start, end):
+    """从 end 倒推到 start 的所有 YYYY-MM（与 batch_dl.sh 一样从新到旧）"""
+    year, month = map(int, end.split('-'))
+    start_year, start_month = map(int, start.split('-'))
+    months = []
+    while (year, month) >= (start_year, start_month):
+        months.append(f"{year:04d}-{month:02d}")
+        month -= 1
+        if month < 1:
+            year, month = year - 1, 12
+    return months
+
+def worker_main(queue_path, worker):
+    """工作进程：不断从共享队列领取任务，交给下载器的流水线处理"""
+    from iwara_batch_downloader import IwaraBatchDownloader
+
+    jobs = JobStore(queue_path)
+    downloader = IwaraBatchDownloader(job_store=jobs)
+    try:
+        success = downloader.process_jobs(jobs.iter_claims(worker))
+        print(f"[工作进程 {worker}] 队列已空，本进程成功 {success} 个")
+    finally:
+        downloader.close()
+        jobs.close()
+
+def print_counts(counts):
+    total = sum(counts.values())
+    running = sum(counts.get(state, 0) for state in ACTIVE_STATES)
+    print(f"[调度] 总计 {total} | 待处理 {counts.get('pending', 0)} | 进行中 {running} | "
+          f"完成 {counts.get('done', 0)} | 失败 {counts.get('failed', 0)} | 已删除 {counts.get('gone', 0)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程批量下载调度器')
+    parser.add_argument('--start', default='2014-02', help='开始月份 YYYY-MM（较早）')
+    parser.add_argument('--end', default='2025-03', help='结束月份 YYYY-MM（较晚）')
+    parser.add_argument('--workers', type=int, default=4, help='工作进程数')
+    parser.add_argument('--source', default=DEFAULT_SOURCE_DIR, help='按月份分类的 JSON 目录')
+    parser.add_argument('--output', default='.', help='视频保存根目录（每个月份一个子目录）')
+    parser.add_argument('--queue', default=DEFAULT_QUEUE_FILE, help='任务队列数据库文件')
+    parser.add_argument('--order', default='name', choices=list(QUEUE_ORDERS),
+                        help='下载顺序：name 为新月份优先、按文件名；smallest 小文件优先；popular 观看数高的优先；'
+                             'newest/oldest 按发布时间；mixed 大小文件交替')
+    args = parser.parse_args()
+
+    jobs = JobStore(args.queue)
+    released = jobs.release()
+    if released:
+        print(f"[调度] 上次运行中断，{released} 个任务重新放回队列")
+
+    # 登记所有月份的任务
+    for month in month_range(args.start, args.end):
+        json_dir = os.path.join(args.source, month)
+        if not os.path.isdir(json_dir):
+            print(f"[调度] 跳过不存在的目录: {json_dir}")
+            continue
+        added = jobs.enqueue(glob.glob(os.path.join(json_dir, '*.json')), os.path.join(args.output, month), month)
+        if added:
+            print(f"[调度] {month}: 新登记 {added} 个任务")
+    ordered = jobs.prioritize(args.order)
+    print(f"[调度] 下载顺序: {args.order}（{ordered} 个未完成任务）")
+    print_counts(jobs.counts())
+
+    # spawn 启动，子进程不继承父进程的 SQLite 连接
+    context = multiprocessing.get_context('spawn')
+    workers = {}  # 编号 -> (进程, 启动时间)
+    fast_failures = {}  # 编号 -> 连续快速失败次数
+    restarts = {}  # 编号 -> 计划重启的时间
+
+    def start_worker(worker):
+        process = context.Process(target=worker_main, args=(args.queue, worker), name=f'worker-{worker}')
+        process.start()
+        workers[worker] = (process, time.time())
+
+    for worker in range(args.workers):
+        start_worker(worker)
+
+    try:
+        while workers or restarts:
+            time.sleep(MONITOR_INTERVAL)
+            for worker, (process, started) in list(workers.items()):
+                if process.is_alive():
+                    continue
+                del workers[worker]
+                if process.exitcode == 0:
+                    continue
+                # 崩溃的进程领取的任务放回队列，还有任务时延迟重启该进程
+                released = jobs.release(worker)
+                print(f"[调度] 工作进程 {worker} 异常退出（{process.exitcode}），{released} 个任务放回队列")
+                if time.time() - started < FAST_FAILURE_SECONDS:
+                    fast_failures[worker] = fast_failures.get(worker, 0) + 1
+                else:
+                    fast_failures[worker] = 1
+                if fast_failures[worker] >= MAX_FAST_FAILURES:
+                    print(f"[调度] 工作进程 {worker} 连续 {fast_failures[worker]} 次启动后很快退出，不再重启")
+                elif jobs.claimable():
+                    delay = RESTART_BACKOFF * 2 ** (fast_failures[worker] - 1)
+                    print(f"[调度] {delay} 秒后重启工作进程 {worker}")
+                    restarts[worker] = time.time() + delay
+            for worker, restart_at in list(restarts.items()):
+                if time.time() >= restart_at:
+                    del restarts[worker]
+                    if jobs.claimable():
+                        start_worker(worker)
+            print_counts(jobs.counts())
+    except KeyboardInterrupt:
+        print("\n[调度] 收到中断，等待工作进程退出...")
+        for process, _ in workers.values():
+            process.join()
+        jobs.release()
+
+    pending = jobs.claimable()
+    if pending:
+        print(f"\n⚠️ 工作进程已全部退出，仍有 {pending} 个任务未处理")
+    else:
+        print("\n所有任务执行完成！")
+    print_counts(jobs.counts())
+    summary = jobs.failure_summary()
+    if summary:
+        print("\n失败摘要:")
+        for reason, count in summary:
+            print(f"  - {reason}: {count} 个")
+    jobs.close()
+
+if __name__ == "__main__":
+    main()
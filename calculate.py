@@ -152,6 +152,31 @@ def calculate_total_size(directory):
     
     print(f"\n✅ 统计报告已保存到: {report_path}")
 
+def calculate_parquet_size(directory):
+    """从 convert_to_parquet.py 生成的数据集统计，只读取 file_size 列"""
+    try:
+        import pyarrow.dataset as ds
+        import pyarrow.compute as pc
+    except ImportError:
+        print("错误：统计 Parquet 数据集需要 pyarrow: pip install pyarrow")
+        return
+    
+    dataset = ds.dataset(directory, format='parquet', partitioning='hive')
+    table = dataset.to_table(columns=['month', 'file_size'], filter=ds.field('file_size') > 0)
+    grouped = table.group_by('month').aggregate([('file_size', 'sum'), ('file_size', 'count')])
+    
+    print(f"{'月份':<12} {'视频数':>8} {'大小(GB)':>12}")
+    print("-" * 40)
+    rows = sorted(grouped.to_pylist(), key=lambda r: r['month'])
+    for row in rows:
+        print(f"{row['month']:<12} {row['file_size_count']:>8} "
+              f"{row['file_size_sum'] / 1024 ** 3:>12,.2f}")
+    
+    total_bytes = pc.sum(table['file_size']).as_py() or 0
+    print("-" * 40)
+    print(f"  视频总数: {table.num_rows:,} 个")
+    print(f"  总大小: {bytes_to_human(total_bytes)} ({total_bytes:,} 字节)")
+
 def main():
     if len(sys.argv) > 1 and sys.argv[1] in ['-h', '--help']:
         print("统计所有视频总大小")
@@ -168,7 +193,11 @@ def main():
         directory = sys.argv[1]
     
     print(f"统计目录: {directory}")
-    calculate_total_size(directory)
+    # convert_to_parquet.py 生成的按月分区数据集
+    if any(Path(directory).glob("month=*")):
+        calculate_parquet_size(directory)
+    else:
+        calculate_total_size(directory)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
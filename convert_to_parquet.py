@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+将 iwara.py 产生的 chunk_*.json / emergency_chunk_*.json / videos_*.ndjson / incremental_*.json / shard_*.json 转换为按月分区的 Parquet 数据集
+- 视频对象展平为固定列（file.size -> file_size 等）
+- zstd 压缩，按 createdAt 的年月分区（month=YYYY-MM）
+- 下游统计只需读取用到的列，例如 calculate.py 只读 file_size
+- 按视频ID跨文件去重（偏移分页会让同一视频出现在多个页面/文件中），每个ID只保留第一次出现
+
+使用方法：
+python convert_to_parquet.py <iwara_data目录> [输出目录]
+"""
+
+import json
+import sys
+from pathlib import Path
+
+from dedup_index import VideoIdIndex
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    print("❌ 请先安装 pyarrow: pip install pyarrow")
+    sys.exit(1)
+
+# 展平后的列定义
+SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('slug', pa.string()),
+    ('title', pa.string()),
+    ('rating', pa.string()),
+    ('private', pa.bool_()),
+    ('unlisted', pa.bool_()),
+    ('embedUrl', pa.string()),
+    ('numViews', pa.int64()),
+    ('numLikes', pa.int64()),
+    ('numComments', pa.int64()),
+    ('createdAt', pa.string()),
+    ('updatedAt', pa.string()),
+    ('file_id', pa.string()),
+    ('file_size', pa.int64()),
+    ('file_duration', pa.float64()),
+    ('file_mime', pa.string()),
+    ('file_width', pa.int64()),
+    ('file_height', pa.int64()),
+    ('user_id', pa.string()),
+    ('user_username', pa.string()),
+    ('user_name', pa.string()),
+    ('tags', pa.list_(pa.string())),
+    ('page', pa.int64()),
+    ('fetchTime', pa.string()),
+    ('month', pa.string()),
+])
+
+def _as_int(value):
+    return int(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def _as_float(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def _as_str(value):
+    return value if isinstance(value, str) else None
+
+def flatten_video(video):
+    """将单个视频对象展平为一行"""
+    file_info = video.get('file') if isinstance(video.get('file'), dict) else {}
+    user = video.get('user') if isinstance(video.get('user'), dict) else {}
+    tags = video.get('tags') if isinstance(video.get('tags'), list) else []
+    created_at = _as_str(video.get('createdAt'))
+
+    return {
+        'id': _as_str(video.get('id')),
+        'slug': _as_str(video.get('slug')),
+        'title': _as_str(video.get('title')),
+        'rating': _as_str(video.get('rating')),
+        'private': bool(video.get('private')),
+        'unlisted': bool(video.get('unlisted')),
+        'embedUrl': _as_str(video.get('embedUrl')),
+        'numViews': _as_int(video.get('numViews')),
+        'numLikes': _as_int(video.get('numLikes')),
+        'numComments': _as_int(video.get('numComments')),
+        'createdAt': created_at,
+        'updatedAt': _as_str(video.get('updatedAt')),
+        'file_id': _as_str(file_info.get('id')),
+        'file_size': _as_int(file_info.get('size')),
+        'file_duration': _as_float(file_info.get('duration')),
+        'file_mime': _as_str(file_info.get('mime')),
+        'file_width': _as_int(file_info.get('width')),
+        'file_height': _as_int(file_info.get('height')),
+        'user_id': _as_str(user.get('id')),
+        'user_username': _as_str(user.get('username')),
+        'user_name': _as_str(user.get('name')),
+        'tags': [t['id'] for t in tags if isinstance(t, dict) and isinstance(t.get('id'), str)],
+        'page': _as_int(video.get('_page')),
+        'fetchTime': _as_str(video.get('_fetchTime')),
+        # createdAt 形如 2024-01-31T12:00:00.000Z，取年月作为分区
+        'month': created_at[:7] if created_at and len(created_at) >= 7 else 'unknown',
+    }
+
+def iter_source_videos(source_file):
+    """读取一个数据文件中的视频（支持 chunk json 和 ndjson）"""
+    if source_file.suffix == '.ndjson':
+        with open(source_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时可能留下被截断的最后一行
+                    continue
+    else:
+        with open(source_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            yield from data.get('videos', [])
+        elif isinstance(data, list):
+            yield from data
+
+def remove_duplicates(videos, id_index):
+    """去掉之前的文件或本文件中已出现过的视频；没有ID的视频保留"""
+    new_ids = set(id_index.add_many(v['id'] for v in videos if isinstance(v.get('id'), str)))
+    unique_videos = []
+    for video in videos:
+        video_id = video.get('id')
+        if not isinstance(video_id, str):
+            unique_videos.append(video)
+        elif video_id in new_ids:
+            unique_videos.append(video)
+            new_ids.discard(video_id)
+    return unique_videos
+
+def convert(input_dir, output_dir):
+    """逐个文件转换，内存只保留一个源文件的数据"""
+    input_path = Path(input_dir)
+    output_path = Path(output_dir)
+
+    # emergency_chunk 是中断时紧急保存的数据，其中的页面已记为完成，不会再次爬取
+    source_files = (sorted(input_path.glob('chunk_*.json')) +
+                    sorted(input_path.glob('emergency_chunk_*.json')) +
+                    sorted(input_path.glob('videos_*.ndjson')) +
+                    sorted(input_path.glob('incremental_*.json')) +
+                    sorted(input_path.glob('shard_*.json')))
+    if not source_files:
+        print(f"错误：在 {input_dir} 中没有找到 chunk/videos/incremental/shard 数据文件")
+        return
+
+    print(f"找到 {len(source_files)} 个数据文件")
+    output_path.mkdir(parents=True, exist_ok=True)
+    # 以下划线开头的文件不会被当作数据集的一部分读取
+    id_index = VideoIdIndex(str(output_path / '_video_ids.sqlite'), reset=True)
+
+    total_rows = 0
+    total_duplicates = 0
+    for i, source_file in enumerate(source_files, 1):
+        try:
+            videos = [v for v in iter_source_videos(source_file) if isinstance(v, dict)]
+        except Exception as e:
+            print(f"  ❌ 读取 {source_file.name} 失败: {e}")
+            continue
+
+        unique_videos = remove_duplicates(videos, id_index)
+        duplicates = len(videos) - len(unique_videos)
+        total_duplicates += duplicates
+        rows = [flatten_video(v) for v in unique_videos]
+        if not rows:
+            print(f"  [{i}/{len(source_files)}] {source_file.name}: 无新视频，跳过")
+            continue
+
+        table = pa.Table.from_pylist(rows, schema=SCHEMA)
+        # 文件名带上源文件名，重复转换时覆盖而不是追加重复数据
+        pq.write_to_dataset(
+            table,
+            root_path=str(output_path),
+            partition_cols=['month'],
+            basename_template=f"{source_file.stem}-{{i}}.parquet",
+            compression='zstd',
+            existing_data_behavior='overwrite_or_ignore'
+        )
+        total_rows += len(rows)
+        print(f"  [{i}/{len(source_files)}] {source_file.name}: {len(rows)} 个视频"
+              + (f"（跳过重复 {duplicates} 个）" if duplicates else ""))
+
+    id_index.close()
+    print(f"\n✅ 转换完成: {total_rows} 个视频（跳过重复 {total_duplicates} 个）→ {output_path}/")
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ['-h', '--help']:
+        print("将爬虫数据转换为按月分区的 Parquet 数据集")
+        print("\n用法:")
+        print("  python convert_to_parquet.py <iwara_data目录> [输出目录]")
+        print("\n示例:")
+        print("  python convert_to_parquet.py iwara_data")
+        print("  python convert_to_parquet.py iwara_data iwara_parquet")
+        return
+
+    input_dir = sys.argv[1]
+    output_dir = sys.argv[2] if len(sys.argv) > 2 else str(Path(input_dir) / 'parquet')
+    convert(input_dir, output_dir)
+
+if __name__ == "__main__":
+    main()
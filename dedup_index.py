@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+视频ID去重索引 - 基于 SQLite 的磁盘集合
+偏移分页在爬取过程中会移动，同一个视频可能出现在多个页面/数据块中
+索引存放在磁盘上，内存占用与视频数量无关，上百万个ID也能快速判断
+
+iwara.py 在写入前查询该索引；separate_videos.py 等后处理脚本也可以直接使用：
+
+    from dedup_index import VideoIdIndex
+    with VideoIdIndex('video_ids.sqlite') as index:
+        new_ids = set(index.add_many(v['id'] for v in videos))
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Iterable, List
+
+class VideoIdIndex:
+    """磁盘上的视频ID集合（线程安全）"""
+
+    def __init__(self, path: str, reset: bool = False):
+        self.path = path
+        if reset and os.path.exists(path):
+            os.remove(path)
+        # 爬虫会在后台线程中提交，连接需要跨线程使用
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS video_ids (id TEXT PRIMARY KEY) WITHOUT ROWID')
+        self.conn.commit()
+        self.lock = threading.Lock()
+
+    def __contains__(self, video_id: str) -> bool:
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM video_ids WHERE id = ?', (video_id,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM video_ids').fetchone()[0]
+
+    def add(self, video_id: str) -> bool:
+        """加入一个ID并立即提交，返回该ID之前是否不存在"""
+        with self.lock:
+            cursor = self.conn.execute('INSERT OR IGNORE INTO video_ids (id) VALUES (?)', (video_id,))
+            self.conn.commit()
+        return cursor.rowcount == 1
+
+    def add_many(self, video_ids: Iterable[str]) -> List[str]:
+        """在一个事务中加入多个ID，返回其中新加入的ID"""
+        added = []
+        with self.lock:
+            for video_id in video_ids:
+                cursor = self.conn.execute('INSERT OR IGNORE INTO video_ids (id) VALUES (?)', (video_id,))
+                if cursor.rowcount == 1:
+                    added.append(video_id)
+            self.conn.commit()
+        return added
+
+    def discard_many(self, video_ids: Iterable[str]):
+        """移除多个ID（恢复时回滚未记入日志的数据）"""
+        with self.lock:
+            self.conn.executemany('DELETE FROM video_ids WHERE id = ?', ((v,) for v in video_ids))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
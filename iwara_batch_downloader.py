@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """
 Iwara 批量视频下载爬虫 - 集成 Playwright 版本（改进版）
+优先直接请求 API 解析下载地址，失败时才使用 Playwright
 自动处理 Playwright 浏览器安装问题
 """
 
@@ -12,10 +13,829 @@ import glob
 from pathlib import Path
 import sys
 import subprocess
+import asyncio
+import hashlib
+import threading
+import secrets
+import socket
+import math
+import tempfile
+import concurrent.futures
+from collections import deque
+from urllib.parse import urlparse, parse_qs
+import aiohttp
+import contextlib
+from contextlib import contextmanager
 from playwright.sync_api import sync_playwright
+from playwright.async_api import async_playwright
+from bandwidth_budget import BandwidthBudget
+from mirror_health import MirrorHealth
+from job_store import JOB_STORE_FILE, MAX_ATTEMPTS, JobStore, video_file_path
+from url_cache import SignedUrlCache, url_expires_at
+from verify_videos import verify_video_file, expected_from_metadata
+
+# 浏览器池配置
+BROWSER_POOL_SIZE = 2  # 常驻的浏览器数量
+BROWSER_MAX_USES = 50  # 每个浏览器处理多少个视频后重启，防止内存泄漏
+BROWSER_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-accelerated-2d-canvas',
+    '--no-first-run',
+    '--no-zygote',
+    '--disable-gpu'
+]
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# 并发解析配置
+RESOLVE_CONCURRENCY = 8  # 同一个浏览器中同时打开的页面数
+RESOLVE_TIMEOUT = 15  # 单个视频等待文件列表响应的最长秒数
+FILE_API_PATTERN = "files.iwara.tv/file"
+ERROR_PAGE_SELECTOR = ('div.text.text--h2.text--bold:has-text("Error"), '
+                       'div.text.text--h2.text--bold:has-text("错误")')
+
+# 直接 API 解析配置（不启动浏览器）
+USE_DIRECT_API = True  # 关闭后只使用 Playwright 解析
+DIRECT_CONCURRENCY = 16  # 同时进行的 API 解析数
+API_VIDEO_URL = 'https://api.iwara.tv/video/'
+# 网页端计算 X-Version 使用的盐值，网站更新后可能变化，可通过环境变量覆盖
+# 签名不对时文件列表请求会失败，自动退回 Playwright 解析
+X_VERSION_SALT = os.environ.get('IWARA_X_VERSION_SALT', '5nFp9kmbNnHdAFhaqMvt')
+
+# 解析时拦截无关资源，只放行页面发起文件列表请求所需的脚本和接口
+BLOCK_RESOURCES = True
+BLOCKED_RESOURCE_TYPES = {'image', 'media', 'font', 'stylesheet'}
+ALLOWED_DOMAINS = ('iwara.tv',)  # 允许的域名（包括子域名），其余第三方域名一律拦截
+
+# 解析/下载流水线配置（两边的并发数各自独立）
+RESOLVE_WORKERS = 16  # 解析协程数
+DOWNLOAD_WORKERS = 4  # 下载线程数
+DOWNLOAD_QUEUE_SIZE = 8  # 已解析待下载的队列长度，队列满时解析暂停，避免签名链接排队过久
+URL_EXPIRY_MARGIN = 300  # 签名链接剩余有效期少于该秒数时重新解析
+# 下载顺序：name（文件名）、smallest（小文件优先）、popular（观看数高的优先）、newest / oldest（按发布时间）、
+# mixed（大小文件交替，保持所有连接忙碌）；排序只使用任务库中的元数据
+QUEUE_ORDER = os.environ.get('IWARA_QUEUE_ORDER', 'name')
+URL_CACHE_FILE = os.environ.get('IWARA_URL_CACHE_FILE', 'signed_url_cache.sqlite')  # 签名链接缓存，重试和重启后复用
+REJECTED_URL_STATUSES = ('HTTP 401', 'HTTP 403', 'HTTP 404', 'HTTP 410')  # 下载时出现这些状态说明链接已失效
+
+# aria2c RPC 配置：整个进程只启动一个常驻 aria2c
+USE_ARIA2_RPC = True  # 关闭后恢复每个文件启动一次 aria2c 的旧方式
+ARIA2_MAX_CONCURRENT = 4  # aria2c 同时下载的文件数（全局上限）
+ARIA2_POLL_INTERVAL = 1  # 查询下载状态的间隔（秒）
+ARIA2_PROGRESS_INTERVAL = 10  # 打印进度的间隔（秒）
+ARIA2_STALL_TIMEOUT = 120  # 超过该秒数没有任何进度才放弃，已下载部分保留用于续传
+
+# 进程内分段下载器配置（默认下载方式，关闭后使用 aria2c）
+USE_NATIVE_DOWNLOADER = True
+SEGMENT_SIZE = 8 * 1024 * 1024  # 每个 Range 分段的大小
+SEGMENT_CONNECTIONS = 8  # 单个文件同时下载的分段数
+SEGMENT_RETRIES = 3  # 单个分段失败后的重试次数
+WRITE_BUFFER_SIZE = 1024 * 1024  # 每次 pwrite 写入的数据量
+DOWNLOAD_PROGRESS_INTERVAL = 10  # 打印进度的间隔（秒）
+SIZE_MISMATCH_ERROR = '文件大小与元数据不符'  # 服务器文件与元数据不一致，重试也不会改变
+
+# 下载镜像：同一个签名链接可以换用任一镜像的域名，按实际下载的延迟/吞吐量/错误率选择，分段级别切换
+MIRROR_HOSTS = tuple(h for h in os.environ.get('IWARA_MIRRORS', 'hime.iwara.tv,mikoto.iwara.tv').split(',') if h)
+
+# 多进程共享的带宽/连接预算（batch_dl.sh 同时运行多个下载进程时按进程数平分）
+BANDWIDTH_LIMIT = float(os.environ.get('IWARA_BANDWIDTH_LIMIT', '0')) * 1024 * 1024  # 总带宽 MB/s，0 为不限制
+CONNECTION_LIMIT = int(os.environ.get('IWARA_CONNECTION_LIMIT', '0'))  # 总连接数，0 为不限制
+BUDGET_FILE = os.environ.get('IWARA_BUDGET_FILE', os.path.join(tempfile.gettempdir(), 'iwara_download_budget.json'))
+
+# 下载完成后的校验（大小、MP4 结构、时长、sha256），失败的任务重新排队
+VERIFY_DOWNLOADS = True
+VERIFY_WORKERS = 2  # 校验线程数（主要受磁盘读取速度限制）
+
+# 质量优先级
+QUALITY_PRIORITY = {
+    'source': 1,
+    '720': 2, 
+    '540': 3,
+    '360': 4,
+    'preview': 99
+}
+
+def parse_file_list(data):
+    """解析 files.iwara.tv/file 返回的文件列表，按质量排序，无可用视频时返回 None"""
+    videos = []
+    for item in data:
+        name_lower = item['name'].lower()
+        priority = 999
+        
+        for quality, p in QUALITY_PRIORITY.items():
+            if quality in name_lower:
+                priority = p
+                break
+        
+        videos.append({
+            'name': item['name'],
+            'type': item['type'],
+            'view_url': f"https:{item['src']['view']}",
+            'download_url': f"https:{item['src']['download']}",
+            'priority': priority
+        })
+    
+    videos.sort(key=lambda x: x['priority'])
+    
+    if not videos:
+        return None
+    return {
+        'best_video': videos[0],
+        'all_videos': videos
+    }
+
+class BrowserPool:
+    """
+    常驻浏览器池：启动少量浏览器重复使用，每个视频只新建一个上下文
+    浏览器使用 BROWSER_MAX_USES 次或崩溃后自动重启
+    """
+    
+    def __init__(self, size=BROWSER_POOL_SIZE, max_uses=BROWSER_MAX_USES):
+        self.size = size
+        self.max_uses = max_uses
+        self.playwright = None
+        self.slots = [{'browser': None, 'uses': 0} for _ in range(size)]
+        self.next_slot = 0
+        
+    def _launch(self):
+        if self.playwright is None:
+            self.playwright = sync_playwright().start()
+        return self.playwright.chromium.launch(
+            headless=True,
+            args=BROWSER_ARGS,
+            timeout=60000  # 增加超时时间
+        )
+        
+    def _recycle(self, slot, reason):
+        """关闭并丢弃一个浏览器，下次使用时重新启动"""
+        print(f"[浏览器池] 重启浏览器（{reason}）")
+        try:
+            if slot['browser'] is not None:
+                slot['browser'].close()
+        except Exception:
+            pass
+        slot['browser'] = None
+        slot['uses'] = 0
+        
+    def _get_slot(self):
+        """轮流使用各个浏览器，按需启动或重启"""
+        slot = self.slots[self.next_slot]
+        self.next_slot = (self.next_slot + 1) % self.size
+        
+        if slot['browser'] is not None:
+            if not slot['browser'].is_connected():
+                self._recycle(slot, '浏览器已断开')
+            elif slot['uses'] >= self.max_uses:
+                self._recycle(slot, f'已使用 {slot["uses"]} 次')
+                
+        if slot['browser'] is None:
+            slot['browser'] = self._launch()
+        return slot
+        
+    @contextmanager
+    def page(self):
+        """获取一个新上下文中的页面，用完自动关闭上下文"""
+        slot = self._get_slot()
+        context = slot['browser'].new_context(
+            viewport={'width': 1920, 'height': 1080},
+            user_agent=USER_AGENT,
+            ignore_https_errors=True
+        )
+        try:
+            if BLOCK_RESOURCES:
+                context.route("**/*", lambda route: route.abort() if should_block_request(route.request) else route.continue_())
+            yield context.new_page()
+        finally:
+            slot['uses'] += 1
+            try:
+                context.close()
+            except Exception:
+                # 关闭上下文失败通常意味着浏览器已崩溃
+                self._recycle(slot, '关闭上下文失败')
+                
+    def close(self):
+        """关闭所有浏览器和 Playwright"""
+        for slot in self.slots:
+            if slot['browser'] is not None:
+                try:
+                    slot['browser'].close()
+                except Exception:
+                    pass
+                slot['browser'] = None
+        if self.playwright is not None:
+            try:
+                self.playwright.stop()
+            except Exception:
+                pass
+            self.playwright = None
+
+def should_block_request(request):
+    """判断解析时是否拦截该请求"""
+    if request.resource_type in BLOCKED_RESOURCE_TYPES:
+        return True
+    host = urlparse(request.url).hostname or ''
+    return not any(host == domain or host.endswith('.' + domain) for domain in ALLOWED_DOMAINS)
+
+def compute_x_version(file_url, salt=X_VERSION_SALT):
+    """计算请求文件列表时需要的 X-Version：sha1(文件ID_expires_盐值)"""
+    parsed = urlparse(file_url)
+    file_id = parsed.path.rstrip('/').split('/')[-1]
+    expires = parse_qs(parsed.query).get('expires', [''])[0]
+    return hashlib.sha1(f"{file_id}_{expires}_{salt}".encode('utf-8')).hexdigest()
+
+class DirectApiResolver:
+    """
+    直接请求 API 解析视频，不启动浏览器：
+    /video/{id} 取得 fileUrl，带上 X-Version 签名请求文件列表
+    """
+    
+    def __init__(self, bearer_token=None, concurrency=DIRECT_CONCURRENCY, timeout=RESOLVE_TIMEOUT):
+        self.bearer_token = bearer_token
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.session = None
+        self.semaphore = None
+        
+    async def start(self):
+        if self.session is not None and not self.session.closed:
+            return
+        headers = {
+            'User-Agent': USER_AGENT,
+            'Origin': 'https://www.iwara.tv',
+            'Referer': 'https://www.iwara.tv/'
+        }
+        if self.bearer_token:
+            headers['Authorization'] = f'Bearer {self.bearer_token}'
+        self.session = aiohttp.ClientSession(
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        
+    async def resolve(self, video_id):
+        """
+        解析单个视频，返回 (视频信息, 错误原因, 是否值得用浏览器重试)
+        视频不存在、外链视频等结果浏览器也无法改变，不再重试
+        """
+        async with self.semaphore:
+            try:
+                async with self.session.get(f"{API_VIDEO_URL}{video_id}") as response:
+                    if response.status == 404:
+                        return None, '页面显示错误（API 返回 404）', False
+                    if response.status != 200:
+                        return None, f'视频信息请求失败: HTTP {response.status}', True
+                    info = await response.json(content_type=None)
+                    
+                file_url = info.get('fileUrl')
+                if not file_url:
+                    # 外链（YouTube 等）视频没有 fileUrl
+                    return None, '视频无 fileUrl（外链或无文件）', False
+                    
+                headers = {'X-Version': compute_x_version(file_url)}
+                async with self.session.get(file_url, headers=headers) as response:
+                    if response.status != 200:
+                        return None, f'文件列表请求失败: HTTP {response.status}', True
+                    data = await response.json(content_type=None)
+            except Exception as e:
+                return None, f'API 请求错误: {str(e)}', True
+                
+        try:
+            video_data = parse_file_list(data)
+        except Exception as e:
+            return None, f'处理响应错误: {str(e)}', True
+        if not video_data:
+            return None, '响应中无可用视频', False
+        return video_data, None, False
+        
+    async def resolve_many(self, video_ids):
+        """并发解析一批视频，返回 {视频ID: (视频信息, 错误原因, 是否值得重试)}"""
+        await self.start()
+        results = await asyncio.gather(*(self.resolve(video_id) for video_id in video_ids))
+        return dict(zip(video_ids, results))
+        
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+class AsyncVideoResolver:
+    """
+    基于 async_api 的并发解析器：一个浏览器中同时打开 RESOLVE_CONCURRENCY 个页面
+    捕获到文件列表响应或错误页面后立即返回，不再固定等待
+    """
+    
+    def __init__(self, concurrency=RESOLVE_CONCURRENCY, timeout=RESOLVE_TIMEOUT):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.playwright = None
+        self.browser = None
+        self.semaphore = None
+        self.start_lock = asyncio.Lock()
+        
+    async def start(self):
+        """启动浏览器（已启动且连接正常时直接返回，崩溃后重新启动）"""
+        # 流水线中多个解析协程会同时调用，加锁避免重复启动浏览器
+        async with self.start_lock:
+            if self.browser is not None and self.browser.is_connected():
+                return
+            if self.playwright is None:
+                self.playwright = await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch(
+                headless=True,
+                args=BROWSER_ARGS,
+                timeout=60000
+            )
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        
+    async def resolve(self, video_id):
+        """解析单个视频，返回 (视频信息, 错误原因)"""
+        url = f"https://www.iwara.tv/video/{video_id}"
+        
+        async with self.semaphore:
+            context = None
+            try:
+                context = await self.browser.new_context(
+                    viewport={'width': 1920, 'height': 1080},
+                    user_agent=USER_AGENT,
+                    ignore_https_errors=True
+                )
+                if BLOCK_RESOURCES:
+                    await context.route("**/*", self._route)
+                page = await context.new_page()
+                return await self._resolve_page(page, url)
+            except Exception as e:
+                return None, f'页面访问错误: {str(e)}'
+            finally:
+                if context is not None:
+                    try:
+                        await context.close()
+                    except Exception:
+                        pass
+                        
+    async def _route(self, route):
+        if should_block_request(route.request):
+            await route.abort()
+        else:
+            await route.continue_()
+            
+    async def _resolve_page(self, page, url):
+        timeout_ms = self.timeout * 1000
+        # 先挂好等待，再开始导航，避免错过响应
+        response_task = asyncio.ensure_future(page.wait_for_event(
+            'response',
+            predicate=lambda response: FILE_API_PATTERN in response.url,
+            timeout=timeout_ms
+        ))
+        error_task = asyncio.ensure_future(page.wait_for_selector(ERROR_PAGE_SELECTOR, timeout=timeout_ms))
+        
+        try:
+            await page.goto(url, wait_until='commit', timeout=timeout_ms)
+            done, _ = await asyncio.wait({response_task, error_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (response_task, error_task):
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(response_task, error_task, return_exceptions=True)
+            
+        if response_task in done and response_task.exception() is None:
+            try:
+                data = await response_task.result().json()
+            except Exception as e:
+                return None, f'处理响应错误: {str(e)}'
+            video_data = parse_file_list(data)
+            if not video_data:
+                return None, '响应中无可用视频'
+            return video_data, None
+            
+        if error_task in done and error_task.exception() is None:
+            return None, '页面显示错误（404或其他错误）'
+            
+        return None, '超时：未找到视频API请求'
+        
+    async def resolve_many(self, video_ids):
+        """并发解析一批视频，返回 {视频ID: (视频信息, 错误原因)}"""
+        await self.start()
+        results = await asyncio.gather(*(self.resolve(video_id) for video_id in video_ids))
+        return dict(zip(video_ids, results))
+        
+    async def close(self):
+        if self.browser is not None:
+            try:
+                await self.browser.close()
+            except Exception:
+                pass
+            self.browser = None
+        if self.playwright is not None:
+            try:
+                await self.playwright.stop()
+            except Exception:
+                pass
+            self.playwright = None
+
+class Aria2RpcDaemon:
+    """
+    常驻 aria2c 进程，通过 JSON-RPC（aria2.addUri / aria2.tellStatus）提交和跟踪下载
+    不再有 60 秒强制超时；失败的任务保留 .aria2 控制文件，下次从断点继续
+    """
+    
+    def __init__(self, max_concurrent=ARIA2_MAX_CONCURRENT, budget=None):
+        self.max_concurrent = max_concurrent
+        self.budget = budget
+        self.applied_rate = None
+        self.process = None
+        self.port = None
+        self.secret = None
+        self.lock = threading.Lock()
+        
+    @staticmethod
+    def _free_port():
+        # 同一台机器上可能同时运行多个下载器，不使用固定端口
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+            
+    def ensure_started(self):
+        """启动 aria2c（已在运行时直接返回，退出后重新启动）"""
+        with self.lock:
+            if self.process is not None and self.process.poll() is None:
+                return
+                
+            self.port = self._free_port()
+            self.secret = secrets.token_hex(16)
+            self.applied_rate = None
+            cmd = [
+                'aria2c',
+                '--enable-rpc',
+                '--rpc-listen-all=false',
+                f'--rpc-listen-port={self.port}',
+                f'--rpc-secret={self.secret}',
+                f'--stop-with-process={os.getpid()}',
+                f'--max-concurrent-downloads={self.max_concurrent}',
+                '--max-connection-per-server=16',
+                '--split=16',
+                '--continue=true',
+                '--auto-file-renaming=false',
+                '--allow-overwrite=true',
+                '--check-certificate=false',
+                '--timeout=20',
+                '--connect-timeout=10',
+                '--max-tries=5',
+                '--retry-wait=3',
+                '--lowest-speed-limit=1K',
+                '--console-log-level=warn',
+                '--quiet=true'
+            ]
+            print(f"[aria2] 启动 RPC 守护进程（端口 {self.port}，最多同时下载 {self.max_concurrent} 个）")
+            self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            
+            # 等待 RPC 可用
+            for _ in range(50):
+                if self.process.poll() is not None:
+                    break
+                try:
+                    self.call('aria2.getVersion')
+                    return
+                except Exception:
+                    time.sleep(0.2)
+            raise RuntimeError('aria2c RPC 启动失败')
+            
+    def call(self, method, *params):
+        payload = {
+            'jsonrpc': '2.0',
+            'id': method,
+            'method': method,
+            'params': [f'token:{self.secret}', *params]
+        }
+        response = requests.post(f'http://127.0.0.1:{self.port}/jsonrpc', json=payload, timeout=10)
+        data = response.json()
+        if 'error' in data:
+            raise RuntimeError(data['error'].get('message', data['error']))
+        return data['result']
+        
+    def download(self, download_urls, filename):
+        """提交下载并等待结束，返回是否成功；download_urls 为同一文件在各个镜像上的地址，由 aria2c 自行切换"""
+        self.ensure_started()
+        name = os.path.basename(filename)
+        options = {
+            'dir': os.path.abspath(os.path.dirname(filename)),
+            'out': name,
+            'user-agent': USER_AGENT,
+            'header': [
+                'Accept: video/mp4,video/*;q=0.9,*/*;q=0.8',
+                'Referer: https://www.iwara.tv/'
+            ]
+        }
+        gid = self.call('aria2.addUri', list(download_urls), options)
+        
+        last_completed = -1
+        last_progress = time.time()
+        last_report = 0
+        try:
+            while True:
+                time.sleep(ARIA2_POLL_INTERVAL)
+                status = self.call('aria2.tellStatus', gid, [
+                    'status', 'totalLength', 'completedLength', 'downloadSpeed', 'errorCode', 'errorMessage'
+                ])
+                state = status['status']
+                self._apply_budget()
+                
+                if state == 'complete':
+                    print(f"[完成] {name}")
+                    return True
+                if state in ('error', 'removed'):
+                    reason = status.get('errorMessage') or f"错误码 {status.get('errorCode')}"
+                    print(f"[aria2] 下载失败: {name} - {reason}")
+                    return False
+                    
+                now = time.time()
+                completed = int(status['completedLength'])
+                total = int(status['totalLength'])
+                
+                # 排队中不算停滞；下载中长时间没有进度才放弃
+                if state != 'active' or completed != last_completed:
+                    last_completed = completed
+                    last_progress = now
+                elif now - last_progress > ARIA2_STALL_TIMEOUT:
+                    print(f"[aria2] {ARIA2_STALL_TIMEOUT} 秒无进度，暂停任务（保留进度）: {name}")
+                    self.call('aria2.remove', gid)
+                    return False
+                    
+                if now - last_report >= ARIA2_PROGRESS_INTERVAL:
+                    last_report = now
+                    if state == 'waiting':
+                        print(f"[aria2] 排队中: {name}")
+                    elif total > 0:
+                        speed = int(status['downloadSpeed']) / 1024 / 1024
+                        print(f"[aria2] {name}: {completed / total * 100:.1f}% "
+                              f"({completed / 1024 / 1024:.1f}/{total / 1024 / 1024:.1f} MB, {speed:.2f} MB/s)")
+        finally:
+            try:
+                self.call('aria2.removeDownloadResult', gid)
+            except Exception:
+                pass
+                
+    def _apply_budget(self):
+        """把本进程的带宽份额同步给 aria2c"""
+        if self.budget is None:
+            return
+        rate = int(self.budget.current_rate())
+        if rate != self.applied_rate:
+            self.call('aria2.changeGlobalOption', {'max-overall-download-limit': str(rate)})
+            self.applied_rate = rate
+            
+    def shutdown(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        try:
+            self.call('aria2.shutdown')
+            self.process.wait(timeout=10)
+        except Exception:
+            self.process.terminate()
+
+class HttpStatusError(RuntimeError):
+    """下载请求返回了意外的 HTTP 状态码，消息为 'HTTP 状态码'（与 REJECTED_URL_STATUSES 对应）"""
+    
+    def __init__(self, status):
+        super().__init__(f'HTTP {status}')
+        self.status = status
+        
+class SegmentLengthError(RuntimeError):
+    """分段实际写入的长度与请求的范围不符（连接中途断开）"""
+    
+def is_mirror_failure(error):
+    """
+    只有超时、连接错误、响应不完整和 5xx 说明镜像本身有问题
+    401/403/404/410 等是签名链接失效，换镜像也一样，不计入镜像健康度
+    """
+    if isinstance(error, HttpStatusError):
+        return error.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+                              SegmentLengthError))
+    
+class RangeDownloader:
+    """
+    进程内分段下载器：按 HTTP Range 分段并发下载，用 os.pwrite 写入预分配的文件
+    旁边的 .segments 文件记录已完成的分段，中断后只下载缺少的部分
+    每个分段按镜像健康度选择服务器，某个镜像失效时剩余分段改用其它镜像
+    """
+    
+    def __init__(self, segment_size=SEGMENT_SIZE, connections=SEGMENT_CONNECTIONS, budget=None, mirrors=None):
+        self.segment_size = segment_size
+        self.connections = connections
+        self.budget = budget
+        self.mirrors = mirrors
+        self.session = None
+        # fdatasync 使用专用线程池，不占用事件循环的默认线程池（DNS 解析等也依赖它）
+        self.sync_pool = concurrent.futures.ThreadPoolExecutor(connections, thread_name_prefix='fdatasync')
+        
+    async def start(self):
+        if self.session is not None and not self.session.closed:
+            return
+        self.session = aiohttp.ClientSession(
+            headers={
+                'User-Agent': USER_AGENT,
+                'Accept': 'video/mp4,video/*;q=0.9,*/*;q=0.8',
+                'Referer': 'https://www.iwara.tv/'
+            },
+            connector=aiohttp.TCPConnector(limit=0, ssl=False),
+            timeout=aiohttp.ClientTimeout(sock_connect=10, sock_read=30)
+        )
+        
+    def _pick(self, urls, exclude=None):
+        return self.mirrors.pick(urls, exclude) if self.mirrors else urls[0]
+        
+    def _record(self, url, error=None, latency=0.0, nbytes=0, seconds=0.0):
+        """把请求结果计入镜像健康度；签名链接本身的问题不算镜像的错误"""
+        if self.mirrors:
+            if error is None:
+                self.mirrors.record_success(url, latency, nbytes, seconds)
+            elif is_mirror_failure(error):
+                self.mirrors.record_error(url)
+                
+    async def _probe_url(self, url):
+        """请求第一个字节，返回 (文件大小, 是否支持 Range)"""
+        started = time.monotonic()
+        async with self.session.get(url, headers={'Range': 'bytes=0-0'}) as response:
+            if response.status == 206:
+                # Content-Range: bytes 0-0/123456
+                result = int(response.headers['Content-Range'].rsplit('/', 1)[1]), True
+            elif response.status == 200 and response.content_length:
+                result = response.content_length, False
+            else:
+                raise HttpStatusError(response.status)
+        self._record(url, latency=time.monotonic() - started)
+        return result
+        
+    async def _probe(self, urls):
+        """按健康度依次在各个镜像上探测，返回 (文件大小, 是否支持 Range)；全部失败时抛出最后一个错误"""
+        url = self._pick(urls)
+        for attempt in range(len(urls)):
+            try:
+                return await self._probe_url(url)
+            except Exception as e:
+                self._record(url, e)
+                if attempt == len(urls) - 1:
+                    raise
+                url = self._pick(urls, exclude=url)
+            
+    @staticmethod
+    def _load_bitmap(state_file, total, segment_size, count):
+        """读取已完成分段的位图，参数不一致或不存在时从头开始"""
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state['size'] == total and state['segment_size'] == segment_size:
+                bitmap = bytearray.fromhex(state['done'])
+                if len(bitmap) == (count + 7) // 8:
+                    return bitmap
+        except Exception:
+            pass
+        return bytearray((count + 7) // 8)
+        
+    @staticmethod
+    def _save_bitmap(state_file, total, segment_size, bitmap):
+        temp_file = state_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({'size': total, 'segment_size': segment_size, 'done': bitmap.hex()}, f)
+        os.replace(temp_file, state_file)
+        
+    async def _fetch_segment(self, url, fd, start, end, ranged, progress):
+        """下载 [start, end] 并写入文件，返回写入的字节数"""
+        headers = {'Range': f'bytes={start}-{end}'} if ranged else {}
+        offset = start
+        # 连接数和带宽都受多进程共享预算限制
+        async with self.budget.connection() if self.budget else contextlib.nullcontext():
+            started = time.monotonic()
+            async with self.session.get(url, headers=headers) as response:
+                if response.status != (206 if ranged else 200):
+                    raise HttpStatusError(response.status)
+                latency = time.monotonic() - started
+                buffer = bytearray()
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    if self.budget:
+                        await self.budget.consume(len(chunk))
+                    buffer += chunk
+                    if len(buffer) >= WRITE_BUFFER_SIZE:
+                        os.pwrite(fd, buffer, offset)
+                        offset += len(buffer)
+                        progress['bytes'] += len(buffer)
+                        buffer = bytearray()
+                if buffer:
+                    os.pwrite(fd, buffer, offset)
+                    offset += len(buffer)
+                    progress['bytes'] += len(buffer)
+            # 吞吐量包含带宽预算的等待，限速时各镜像得分同样受影响
+            self._record(url, latency=latency, nbytes=offset - start, seconds=time.monotonic() - started)
+        return offset - start
+        
+    async def download(self, url, filename, expected_size=None):
+        """下载到 filename，返回 (是否成功, 错误原因)"""
+        await self.start()
+        name = os.path.basename(filename)
+        state_file = filename + '.segments'
+        urls = self.mirrors.candidates(url) if self.mirrors else [url]
+        
+        total, ranged = await self._probe(urls)
+        if expected_size and total != expected_size:
+            return False, f'{SIZE_MISMATCH_ERROR}: 服务器 {total} / 元数据 {expected_size}'
+            
+        segment_size = self.segment_size if ranged else total
+        count = max(1, math.ceil(total / segment_size))
+        # 只有视频文件仍然存在且长度完整时，位图中已完成的分段才可信
+        resumable = ranged and os.path.exists(filename) and os.path.getsize(filename) == total
+        bitmap = (self._load_bitmap(state_file, total, segment_size, count) if resumable
+                  else bytearray((count + 7) // 8))
+        missing = deque(i for i in range(count) if not bitmap[i >> 3] & (1 << (i & 7)))
+        done_bytes = total - sum(min(segment_size, total - i * segment_size) for i in missing)
+        if done_bytes:
+            print(f"[下载] 断点续传 {name}: 已完成 {done_bytes / 1024 / 1024:.1f}/{total / 1024 / 1024:.1f} MB")
+            
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+        errors = []
+        try:
+            # 下载完成前进度文件一直存在，预分配后崩溃留下的全长文件不会被当作已完成
+            self._save_bitmap(state_file, total, segment_size, bitmap)
+            # 预分配文件空间
+            if os.fstat(fd).st_size != total:
+                os.ftruncate(fd, total)
+                if hasattr(os, 'posix_fallocate'):
+                    try:
+                        os.posix_fallocate(fd, 0, total)
+                    except OSError:
+                        pass
+                        
+            # 同一个下载器会被多个下载线程同时使用，进度放在局部变量中
+            progress = {'bytes': 0}
+            
+            async def segment_worker():
+                while missing and not errors:
+                    index = missing.popleft()
+                    start = index * segment_size
+                    end = min(start + segment_size, total) - 1
+                    segment_url = self._pick(urls)
+                    # 每个镜像至少尝试一次
+                    attempts = SEGMENT_RETRIES + len(urls)
+                    for attempt in range(attempts):
+                        try:
+                            written = await self._fetch_segment(segment_url, fd, start, end, ranged, progress)
+                            if written != end - start + 1:
+                                raise SegmentLengthError(f'分段长度不符: {written}/{end - start + 1}')
+                            break
+                        except Exception as e:
+                            self._record(segment_url, e)
+                            if attempt == attempts - 1:
+                                errors.append(f'分段 {index} 下载失败: {e}')
+                                return
+                            # 有其它可用镜像时立即切换，否则等待后重试
+                            next_url = self._pick(urls, exclude=segment_url)
+                            if next_url == segment_url:
+                                # 所有镜像都停用时等到最早恢复的镜像
+                                wait = self.mirrors.wait_time(urls) if self.mirrors else 0
+                                await asyncio.sleep(min(max(2 ** attempt, wait), 30))
+                            else:
+                                print(f"[镜像] {name} 分段 {index} 切换到 {urlparse(next_url).hostname}")
+                            segment_url = next_url
+                    bitmap[index >> 3] |= 1 << (index & 7)
+                    if ranged:
+                        # 分段数据落盘后才记录为已完成，崩溃后不会跳过没有写入磁盘的分段
+                        await asyncio.get_running_loop().run_in_executor(self.sync_pool, os.fdatasync, fd)
+                        self._save_bitmap(state_file, total, segment_size, bitmap)
+                        
+            async def report_progress():
+                while True:
+                    await asyncio.sleep(DOWNLOAD_PROGRESS_INTERVAL)
+                    completed = done_bytes + progress['bytes']
+                    print(f"[下载] {name}: {completed / total * 100:.1f}% "
+                          f"({completed / 1024 / 1024:.1f}/{total / 1024 / 1024:.1f} MB)")
+                    
+            reporter = asyncio.ensure_future(report_progress())
+            try:
+                await asyncio.gather(*(segment_worker() for _ in range(self.connections if ranged else 1)))
+            finally:
+                reporter.cancel()
+                
+            if errors:
+                return False, errors[0]
+                
+            os.fsync(fd)
+            if os.fstat(fd).st_size != total:
+                return False, f'文件长度不符: {os.fstat(fd).st_size}/{total}'
+        finally:
+            os.close(fd)
+            
+        if os.path.exists(state_file):
+            os.remove(state_file)
+        return True, None
+        
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.sync_pool.shutdown(wait=True)
 
 class IwaraBatchDownloader:
-    def __init__(self, bearer_token=None):
+    def __init__(self, bearer_token=None, job_store=None):
         self.bearer_token = bearer_token
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
@@ -23,13 +843,129 @@ class IwaraBatchDownloader:
         if bearer_token:
             self.headers['Authorization'] = f'Bearer {bearer_token}'
         self.api_base = 'https://api.iwara.tv/video/'
-        self.failed_downloads = []
         self.last_playwright_error = None
-        self.skip_count = 0
+        
+        # 任务状态库：传入时所有保存目录共用，否则每个保存目录一个
+        self.job_store = job_store
+        self.job_stores = {}
+        
+        # 后台校验线程
+        self.verify_pool = concurrent.futures.ThreadPoolExecutor(VERIFY_WORKERS, thread_name_prefix='verify')
+        self.verify_futures = set()
         
         # 检查并安装 Playwright 浏览器
         self._ensure_playwright_installed()
         
+        # 常驻浏览器池，并发解析失败时逐个解析
+        # 同步 Playwright 对象只能在创建它的线程中使用，浏览器池只在这个专用线程中访问
+        self.browser_pool = BrowserPool()
+        self.playwright_thread = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='playwright')
+        self.stats_lock = threading.Lock()
+        
+        # 与同机其它下载进程共享的带宽/连接预算
+        self.budget = BandwidthBudget(BUDGET_FILE, BANDWIDTH_LIMIT, CONNECTION_LIMIT)
+        if BANDWIDTH_LIMIT or CONNECTION_LIMIT:
+            print(f"[带宽] 总预算: {BANDWIDTH_LIMIT / 1024 / 1024:.1f} MB/s, {CONNECTION_LIMIT} 个连接（0 为不限制），"
+                  f"当前 {self.budget.active_processes} 个进程共享")
+        
+        # 常驻 aria2c，首次下载时启动
+        self.aria2 = Aria2RpcDaemon(budget=self.budget)
+        
+        # 镜像健康度，分段下载器和 aria2c 共用
+        self.mirrors = MirrorHealth(MIRROR_HOSTS, SEGMENT_SIZE)
+        
+        # 进程内分段下载器，运行在同一个事件循环中
+        self.native_downloader = RangeDownloader(budget=self.budget, mirrors=self.mirrors)
+        
+        # 并发解析器运行在常驻事件循环中，浏览器跨批次复用
+        self.loop = asyncio.new_event_loop()
+        self.direct_resolver = DirectApiResolver(bearer_token)
+        self.resolver = AsyncVideoResolver()
+        self.resolved = {}  # 视频ID -> (视频信息, 错误原因)
+        
+        # 签名链接缓存：链接有效期内的重试、换下载方式和重启都不再重新解析
+        self.url_cache = SignedUrlCache(URL_CACHE_FILE, URL_EXPIRY_MARGIN)
+        
+    def close(self):
+        """释放解析器和浏览器池"""
+        try:
+            self.loop.run_until_complete(self.direct_resolver.close())
+            self.loop.run_until_complete(self.resolver.close())
+            self.loop.run_until_complete(self.native_downloader.close())
+        finally:
+            self.loop.close()
+        self.playwright_thread.submit(self.browser_pool.close).result()
+        self.playwright_thread.shutdown(wait=True)
+        self.aria2.shutdown()
+        self.verify_pool.shutdown(wait=True)
+        self.budget.close()
+        self.url_cache.close()
+        for store in self.job_stores.values():
+            store.close()
+        
+    async def _resolve_async(self, video_ids):
+        """
+        先查签名链接缓存，再走直接 API，失败的再交给 Playwright，返回 {视频ID: (视频信息, 错误原因)}
+        新解析成功的结果写入缓存
+        """
+        resolved = {}
+        for video_id in video_ids:
+            cached = self.url_cache.get(video_id)
+            if cached is not None:
+                resolved[video_id] = (cached, None)
+        if resolved:
+            print(f"[缓存] {len(resolved)}/{len(video_ids)} 个视频使用缓存的下载链接")
+        pending = [v for v in video_ids if v not in resolved]
+        if not pending:
+            return resolved
+        fresh = {}
+        
+        if USE_DIRECT_API:
+            try:
+                results = await self.direct_resolver.resolve_many(pending)
+            except Exception as e:
+                print(f"[API] 直接解析失败: {e}")
+                results = {}
+            for video_id, (data, error, retryable) in results.items():
+                if retryable:
+                    print(f"[API] {video_id}: {error}，改用 Playwright 解析")
+                else:
+                    fresh[video_id] = (data, error)
+            pending = [v for v in pending if v not in fresh]
+                
+        if pending:
+            try:
+                fresh.update(await self.resolver.resolve_many(pending))
+            except Exception as e:
+                # 未解析的视频由 process_video 改用浏览器池逐个解析
+                print(f"[解析] Playwright 并发解析失败: {e}")
+                
+        for video_id, (data, _) in fresh.items():
+            if data:
+                self.url_cache.put(video_id, data)
+        resolved.update(fresh)
+        return resolved
+        
+    def _run_coro(self, coro):
+        """在常驻事件循环中运行协程；流水线运行时从下载线程提交到事件循环"""
+        if self.loop.is_running():
+            return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+        return self.loop.run_until_complete(coro)
+        
+    def _resolve_now(self, video_ids):
+        """同步解析一批视频"""
+        return self._run_coro(self._resolve_async(video_ids))
+        
+    def prefetch_video_info(self, video_ids):
+        """并发解析一批视频，结果暂存在 self.resolved 中供 process_video 使用"""
+        if not video_ids:
+            return
+        start = time.time()
+        results = self._resolve_now(video_ids)
+        self.resolved.update(results)
+        ok = sum(1 for data, _ in results.values() if data)
+        print(f"[解析] 完成: {ok}/{len(video_ids)} 个成功，耗时 {time.time() - start:.2f} 秒")
+        
     def _ensure_playwright_installed(self):
         """确保 Playwright 浏览器已安装"""
         try:
@@ -78,83 +1014,22 @@ class IwaraBatchDownloader:
         error_info = None
         
         try:
-            with sync_playwright() as p:
-                # 添加更多启动选项以提高稳定性
-                browser_args = [
-                    '--no-sandbox',
-                    '--disable-setuid-sandbox',
-                    '--disable-dev-shm-usage',
-                    '--disable-accelerated-2d-canvas',
-                    '--no-first-run',
-                    '--no-zygote',
-                    '--single-process',  # 在某些环境下需要
-                    '--disable-gpu'
-                ]
-                
-                browser = p.chromium.launch(
-                    headless=True, 
-                    args=browser_args,
-                    timeout=60000  # 增加超时时间
-                )
-                
-                # 创建上下文时添加更多选项
-                context = browser.new_context(
-                    viewport={'width': 1920, 'height': 1080},
-                    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                    ignore_https_errors=True
-                )
-                
-                page = context.new_page()
-                
+            # 从浏览器池取一个新上下文中的页面，不再每个视频启动一次浏览器
+            with self.browser_pool.page() as page:
                 result = {'found': False, 'data': None, 'error': None}
-                target_pattern = "files.iwara.tv/file"
                 
                 def handle_response(response):
-                    if target_pattern in response.url and not result['found']:
+                    if FILE_API_PATTERN in response.url and not result['found']:
                         result['found'] = True
                         
                         try:
                             body = response.body()
                             data = json.loads(body)
                             
-                            # 定义质量优先级
-                            quality_priority = {
-                                'source': 1,
-                                '720': 2, 
-                                '540': 3,
-                                '360': 4,
-                                'preview': 99
-                            }
-                            
-                            # 解析并排序视频
-                            videos = []
-                            for item in data:
-                                name_lower = item['name'].lower()
-                                priority = 999
-                                
-                                for quality, p in quality_priority.items():
-                                    if quality in name_lower:
-                                        priority = p
-                                        break
-                                
-                                videos.append({
-                                    'name': item['name'],
-                                    'type': item['type'],
-                                    'view_url': f"https:{item['src']['view']}",
-                                    'download_url': f"https:{item['src']['download']}",
-                                    'priority': priority
-                                })
-                            
-                            videos.sort(key=lambda x: x['priority'])
-                            
-                            if videos:
-                                best_video = videos[0]
-                                print(f"[Playwright] 找到最佳质量: {best_video['name']}")
-                                
-                                result['data'] = {
-                                    'best_video': best_video,
-                                    'all_videos': videos
-                                }
+                            video_data = parse_file_list(data)
+                            if video_data:
+                                print(f"[Playwright] 找到最佳质量: {video_data['best_video']['name']}")
+                                result['data'] = video_data
                             else:
                                 result['error'] = '响应中无可用视频'
                             
@@ -196,15 +1071,11 @@ class IwaraBatchDownloader:
                         except:
                             pass
                     
-                    # 如果检测到错误页面，直接返回
+                    # 如果检测到错误页面，直接返回（上下文由浏览器池关闭）
                     if is_error_page:
                         error_info = '页面显示错误（404或其他错误）'
                         print(f"[Playwright] {error_info} - 跳过此视频")
                         result['error'] = error_info
-                        # 立即关闭资源并返回
-                        page.close()
-                        context.close()
-                        browser.close()
                         self.last_playwright_error = error_info
                         return None
                     
@@ -223,30 +1094,19 @@ class IwaraBatchDownloader:
                     error_info = f'页面访问错误: {str(e)}'
                     print(f"[Playwright] {error_info}")
                 
-                # 立即关闭所有资源
-                page.close()
-                context.close()
-                browser.close()
-                
-                # 返回数据或None
-                if result['data']:
-                    return result['data']
+            # 返回数据或None
+            if result['data']:
+                return result['data']
+            else:
+                # 记录错误信息
+                if result['error']:
+                    self.last_playwright_error = result['error']
+                elif error_info:
+                    self.last_playwright_error = error_info
                 else:
-                    # 记录错误信息
-                    if result['error']:
-                        self.last_playwright_error = result['error']
-                    elif error_info:
-                        self.last_playwright_error = error_info
-                    else:
-                        self.last_playwright_error = '未知错误'
-                    
-                    # 如果是特定错误且重试次数未超限，则重试
-                    if retry_count < 2 and self.last_playwright_error and "Executable doesn't exist" in self.last_playwright_error:
-                        print(f"[Playwright] 检测到浏览器问题，尝试重新初始化... (重试 {retry_count + 1}/2)")
-                        self._ensure_playwright_installed()
-                        return self.get_video_info_playwright(video_id, retry_count + 1)
-                    
-                    return None
+                    self.last_playwright_error = '未知错误'
+                
+                return None
                 
         except Exception as e:
             self.last_playwright_error = f'Playwright初始化错误: {str(e)}'
@@ -255,11 +1115,42 @@ class IwaraBatchDownloader:
             # 如果是浏览器未安装的错误，尝试重新安装
             if retry_count < 2 and ("Executable doesn't exist" in str(e) or "Looks like Playwright" in str(e)):
                 print(f"[Playwright] 尝试重新安装浏览器... (重试 {retry_count + 1}/2)")
+                self.browser_pool.close()
                 self._ensure_playwright_installed()
                 return self.get_video_info_playwright(video_id, retry_count + 1)
                 
             return None
     
+    def download_video_native(self, download_url, filename, expected_size=None, video_id=None):
+        """
+        使用进程内分段下载器下载，expected_size 为元数据中的 file.size，返回 (是否成功, 错误原因)
+        链接被服务器拒绝时删除 video_id 的缓存，下次重试重新解析
+        """
+        if download_url.startswith('//'):
+            download_url = 'https:' + download_url
+            
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        
+        print(f"[下载URL] {download_url}")
+        print(f"[保存路径] {filename}")
+        
+        try:
+            success, reason = self._run_coro(self.native_downloader.download(download_url, filename, expected_size))
+        except Exception as e:
+            success, reason = False, str(e)
+            
+        if success:
+            # 之前 aria2c 留下的控制文件已失效
+            if os.path.exists(filename + '.aria2'):
+                os.remove(filename + '.aria2')
+            print(f"[完成] {os.path.basename(filename)} ✓")
+        else:
+            print(f"[错误] 下载失败（已保留进度）: {reason}")
+            if video_id and any(status in reason for status in REJECTED_URL_STATUSES):
+                self.url_cache.invalidate(video_id)
+            print(f"[镜像] {self.mirrors.summary()}")
+        return success, reason
+        
     def download_video_aria2c(self, download_url, filename):
         """使用 aria2c 下载视频文件"""
         if download_url.startswith('//'):
@@ -271,6 +1162,17 @@ class IwaraBatchDownloader:
         print(f"[下载URL] {download_url}")
         print(f"[保存路径] {filename}")
         
+        if USE_ARIA2_RPC:
+            try:
+                return self.aria2.download(self.mirrors.candidates(download_url), filename)
+            except FileNotFoundError:
+                print("[错误] aria2c 未安装，尝试 wget")
+                return self.download_video_wget(download_url, filename)
+            except Exception as e:
+                # aria2c 预分配了文件空间，不能交给 wget -c 续传；保留进度，下次运行继续
+                print(f"[错误] aria2c RPC 失败: {e}")
+                return False
+        
         # 构建 aria2c 命令
         cmd = [
             'aria2c',
@@ -391,44 +1293,55 @@ class IwaraBatchDownloader:
             print(f"[错误] wget 失败: {e}")
             return False
             
-    def process_video(self, video_id, json_filename, save_dir='downloads'):
-        """处理单个视频 - 使用 Playwright 获取视频信息"""
-        # 重置错误信息
-        self.last_playwright_error = None
+    def _resolve_with_browser_pool(self, video_id):
+        """在专用线程中用浏览器池逐个解析，返回 (视频信息, 错误原因)"""
+        def resolve():
+            self.last_playwright_error = None
+            return self.get_video_info_playwright(video_id), self.last_playwright_error
+        return self.playwright_thread.submit(resolve).result()
         
-        # 使用 Playwright 获取视频信息
-        video_data = self.get_video_info_playwright(video_id)
+    def process_video(self, video_id, json_filename, save_dir='downloads', resolved=None, metadata=None,
+                      started=False):
+        """
+        处理单个视频 - resolved 为流水线中已解析的 (视频信息, 错误原因)
+        metadata 为视频的 JSON 元数据，用于校验文件大小
+        started 表示流水线已经为本次尝试调用过 store.start
+        """
+        store = self._jobs(save_dir)
+        if not started:
+            store.start(json_filename, video_id)
+            
+        # 优先使用已解析的结果，未预先解析的视频单独解析
+        # 错误原因保存在局部变量中，流水线的多个下载线程互不干扰
+        if resolved is None:
+            resolved = self.resolved.pop(video_id, None)
+        if resolved is None:
+            resolved = self._resolve_now([video_id]).get(video_id)
+        if resolved is not None:
+            video_data, resolve_error = resolved
+        else:
+            video_data, resolve_error = self._resolve_with_browser_pool(video_id)
+            if video_data:
+                self.url_cache.put(video_id, video_data)
         
         if not video_data:
-            error_reason = self.last_playwright_error or 'Playwright 获取视频信息失败（未知原因）'
-            # 如果是页面错误，使用不同的记录方式
+            error_reason = resolve_error or 'Playwright 获取视频信息失败（未知原因）'
+            # 页面错误和外链视频重试也没有用，不再重试
             if '页面显示错误' in error_reason:
-                self.failed_downloads.append({
-                    'id': video_id,
-                    'json_file': json_filename,
-                    'reason': '视频不存在或已删除（错误页面）',
-                    'time': time.strftime('%Y-%m-%d %H:%M:%S')
-                })
+                store.fail(json_filename, '视频不存在或已删除（错误页面）', permanent=True)
                 print(f"[跳过] 视频页面不存在: {video_id}")
+            elif '无 fileUrl' in error_reason:
+                store.fail(json_filename, error_reason, permanent=True)
+                print(f"[跳过] {error_reason}: {video_id}")
             else:
-                self.failed_downloads.append({
-                    'id': video_id,
-                    'json_file': json_filename,
-                    'reason': error_reason,
-                    'time': time.strftime('%Y-%m-%d %H:%M:%S')
-                })
+                store.fail(json_filename, error_reason)
                 print(f"[错误] {error_reason}")
             return False
             
         # 获取最佳质量的视频
         best_video = video_data.get('best_video')
         if not best_video:
-            self.failed_downloads.append({
-                'id': video_id,
-                'json_file': json_filename,
-                'reason': '无可用视频质量',
-                'time': time.strftime('%Y-%m-%d %H:%M:%S')
-            })
+            store.fail(json_filename, '无可用视频质量')
             return False
             
         print(f"[选择质量] {best_video['name']}")
@@ -436,42 +1349,91 @@ class IwaraBatchDownloader:
         # 获取下载URL
         download_url = best_video.get('download_url')
         if not download_url:
-            self.failed_downloads.append({
-                'id': video_id,
-                'json_file': json_filename,
-                'reason': '视频无下载链接',
-                'time': time.strftime('%Y-%m-%d %H:%M:%S')
-            })
+            store.fail(json_filename, '视频无下载链接')
             return False
             
         # 使用与JSON文件相同的文件名（去掉.json后缀，加上.mp4）
-        base_name = os.path.splitext(os.path.basename(json_filename))[0]
-        filename = os.path.join(save_dir, f"{base_name}.mp4")
+        filename = video_file_path(json_filename, save_dir)
         
-        # 下载视频
-        success = self.download_video_aria2c(download_url, filename)
+        # 签名链接即将过期时重新解析
+        expires_at = url_expires_at(download_url)
+        if expires_at and expires_at - time.time() < URL_EXPIRY_MARGIN:
+            print(f"[解析] 下载链接即将过期，重新解析: {video_id}")
+            refreshed, _ = self._resolve_now([video_id]).get(video_id, (None, None))
+            if refreshed:
+                download_url = refreshed['best_video']['download_url']
+                
+        # 下载视频；只有原画质量的大小与元数据中的 file.size 对应
+        store.set_state(json_filename, 'downloading', best_video['name'])
+        expected_size, expected_duration = expected_from_metadata(metadata, best_video['name'])
+        if USE_NATIVE_DOWNLOADER:
+            success, reason = self.download_video_native(download_url, filename, expected_size, video_id)
+        else:
+            success, reason = self.download_video_aria2c(download_url, filename), None
         
-        if not success:
-            self.failed_downloads.append({
-                'id': video_id,
-                'json_file': json_filename,
-                'reason': '下载失败（网络或文件问题）',
-                'download_url': download_url,
-                'time': time.strftime('%Y-%m-%d %H:%M:%S')
-            })
+        if not success and reason and reason.startswith(SIZE_MISMATCH_ERROR):
+            store.fail(json_filename, reason, permanent=True)
+        elif not success:
+            store.fail(json_filename, '下载失败（网络或文件问题）')
+        elif VERIFY_DOWNLOADS:
+            # 校验在后台线程中进行，下载线程继续处理下一个视频
+            store.set_state(json_filename, 'verifying')
+            future = self.verify_pool.submit(self._verify_download, store, json_filename, filename,
+                                             expected_size, expected_duration)
+            with self.stats_lock:
+                self.verify_futures.add(future)
+            future.add_done_callback(self._discard_verify_future)
+        else:
+            store.finish(json_filename, os.path.getsize(filename))
             
         return success
         
-    def process_json_file(self, json_path, save_dir='downloads'):
-        """处理单个 JSON 文件"""
-        try:
-            # 先检查对应的MP4文件是否已存在
-            base_name = os.path.splitext(os.path.basename(json_path))[0]
-            mp4_filename = os.path.join(save_dir, f"{base_name}.mp4")
+    def _verify_download(self, store, json_filename, filename, expected_size, expected_duration):
+        """校验下载的文件，通过后记录哈希；失败时删除文件并重新排队"""
+        name = os.path.basename(filename)
+        ok, reason, digest = verify_video_file(filename, expected_size, expected_duration)
+        if ok:
+            store.finish(json_filename, os.path.getsize(filename), digest)
+            print(f"[校验] 通过: {name}")
+        else:
+            print(f"[校验] 失败: {name} - {reason}，删除后重新排队")
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            store.fail(json_filename, f'校验失败: {reason}')
+            
+    def _discard_verify_future(self, future):
+        with self.stats_lock:
+            self.verify_futures.discard(future)
+            
+    def wait_verifications(self):
+        """等待所有后台校验结束"""
+        with self.stats_lock:
+            futures = list(self.verify_futures)
+        if futures:
+            print(f"[校验] 等待 {len(futures)} 个文件校验完成...")
+            concurrent.futures.wait(futures)
+        
+    def _jobs(self, save_dir):
+        """返回保存目录对应的任务状态库"""
+        if self.job_store is not None:
+            return self.job_store
+        key = os.path.abspath(save_dir)
+        with self.stats_lock:
+            if key not in self.job_stores:
+                os.makedirs(save_dir, exist_ok=True)
+                self.job_stores[key] = JobStore(os.path.join(save_dir, JOB_STORE_FILE))
+            return self.job_stores[key]
             
-            if os.path.exists(mp4_filename) and os.path.getsize(mp4_filename) > 0:
-                print(f"[跳过] 文件已存在: {base_name}.mp4")
-                self.skip_count += 1
+    def process_json_file(self, json_path, save_dir='downloads', resolved=None, started=False):
+        """处理单个 JSON 文件；started 表示流水线已经登记了本次尝试"""
+        store = self._jobs(save_dir)
+        try:
+            # 先查任务状态库，已完成的跳过（未登记的任务登记时会检查已有文件）
+            store.enqueue([json_path], save_dir)
+            if store.state(json_path) == 'done':
+                print(f"[跳过] 已完成: {os.path.basename(json_path)}")
                 return True  # 返回True表示"成功"（已存在）
             
             # 读取JSON文件
@@ -481,36 +1443,87 @@ class IwaraBatchDownloader:
             video_id = data.get('id')
             if not video_id:
                 print(f"[警告] JSON 文件无 ID: {json_path}")
-                self.failed_downloads.append({
-                    'json_file': json_path,
-                    'reason': 'JSON文件中无视频ID',
-                    'time': time.strftime('%Y-%m-%d %H:%M:%S')
-                })
+                store.fail(json_path, 'JSON文件中无视频ID', permanent=True)
                 return False
                 
             print(f"\n[处理] {os.path.basename(json_path)}")
             
-            return self.process_video(video_id, json_path, save_dir)
+            return self.process_video(video_id, json_path, save_dir, resolved, data, started)
             
         except json.JSONDecodeError as e:
             error_msg = f"JSON解析错误: {e}"
             print(f"[错误] {error_msg} - {json_path}")
-            self.failed_downloads.append({
-                'json_file': json_path,
-                'reason': error_msg,
-                'time': time.strftime('%Y-%m-%d %H:%M:%S')
-            })
+            store.fail(json_path, error_msg, permanent=True)
             return False
         except Exception as e:
             error_msg = f"读取文件错误: {str(e)}"
             print(f"[错误] {error_msg} - {json_path}")
-            self.failed_downloads.append({
-                'json_file': json_path,
-                'reason': error_msg,
-                'time': time.strftime('%Y-%m-%d %H:%M:%S')
-            })
+            store.fail(json_path, error_msg)
             return False
             
+    def _pending_video_id(self, json_path, save_dir):
+        """返回需要下载的视频ID；已完成或无法读取时返回 None（由 process_json_file 处理）"""
+        if self._jobs(save_dir).state(json_path) == 'done':
+            return None
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('id')
+        except Exception:
+            return None
+            
+    async def _run_pipeline(self, source, total=None):
+        """
+        解析 -> 下载流水线：解析协程把签名链接放入有界队列，下载线程取出下载
+        source 产生 (json文件, 保存目录)，可以是从共享任务队列按需领取的生成器
+        队列是事件循环中的 asyncio.Queue，队列满时解析协程在循环中等待，不占用任何线程
+        返回成功数量
+        """
+        loop = asyncio.get_running_loop()
+        source = iter(source)
+        jobs = asyncio.Queue(maxsize=DOWNLOAD_QUEUE_SIZE)
+        progress = {'done': 0, 'success': 0}
+        
+        def download_worker():
+            while True:
+                job = asyncio.run_coroutine_threadsafe(jobs.get(), loop).result()
+                if job is None:
+                    break
+                json_file, save_dir, resolved, started = job
+                result = self.process_json_file(json_file, save_dir, resolved, started)
+                with self.stats_lock:
+                    progress['done'] += 1
+                    if result:
+                        progress['success'] += 1
+                    print(f"\n========== 进度: {progress['done']}/{total or '?'} ==========")
+                    
+        async def resolve_worker():
+            # 所有解析协程共用同一个迭代器，每次取下一个任务
+            for json_file, save_dir in source:
+                # 已下载或无法读取的文件不需要解析，直接交给 process_json_file 处理
+                video_id = self._pending_video_id(json_file, save_dir)
+                resolved = None
+                if video_id:
+                    self._jobs(save_dir).start(json_file, video_id)
+                    resolved = (await self._resolve_async([video_id])).get(video_id)
+                await jobs.put((json_file, save_dir, resolved, bool(video_id)))
+                
+        # 下载线程使用专用线程池，等待它们结束也不占用默认线程池
+        with concurrent.futures.ThreadPoolExecutor(DOWNLOAD_WORKERS, thread_name_prefix='download') as pool:
+            workers = [loop.run_in_executor(pool, download_worker) for _ in range(DOWNLOAD_WORKERS)]
+            await asyncio.gather(*(resolve_worker() for _ in range(RESOLVE_WORKERS)))
+            for _ in workers:
+                await jobs.put(None)
+            await asyncio.gather(*workers)
+            
+        return progress['success']
+        
+    def process_jobs(self, source, total=None):
+        """用流水线处理 (json文件, 保存目录) 任务，返回成功数量（供 batch_download.py 的工作进程使用）"""
+        print(f"\n[流水线] 解析协程: {RESOLVE_WORKERS}，下载线程: {DOWNLOAD_WORKERS}")
+        success = self.loop.run_until_complete(self._run_pipeline(source, total))
+        self.wait_verifications()
+        return success
+        
     def process_directory(self, directory_path, save_dir='downloads'):
         """处理整个目录的 JSON 文件"""
         json_files = glob.glob(os.path.join(directory_path, '*.json'))
@@ -531,7 +1544,10 @@ class IwaraBatchDownloader:
         # 清理未完成的下载
         print("\n[清理] 检查未完成的下载...")
         aria2_files = glob.glob(os.path.join(save_dir, '*.aria2'))
-        if aria2_files:
+        if aria2_files and (USE_ARIA2_RPC or USE_NATIVE_DOWNLOADER):
+            # aria2c RPC 会根据控制文件断点续传，不再删除
+            print(f"[清理] 保留 {len(aria2_files)} 个未完成的下载，稍后断点续传")
+        elif aria2_files:
             print(f"[清理] 发现 {len(aria2_files)} 个未完成的下载")
             for aria2_file in aria2_files:
                 os.remove(aria2_file)
@@ -544,48 +1560,41 @@ class IwaraBatchDownloader:
         else:
             print("[清理] 没有发现未完成的下载")
         
-        # 重置计数器
-        self.skip_count = 0
-        success_count = 0
+        # 登记任务（只有新任务会检查已有文件），然后用一次查询得到需要处理的任务
+        store = self._jobs(save_dir)
+        added = store.enqueue(json_files, save_dir)
+        store.prioritize(QUEUE_ORDER, save_dir)
+        pending = store.pending(save_dir)
+        print(f"[任务] 新登记 {added} 个，本次需要处理 {len(pending)} 个，顺序: {QUEUE_ORDER}（任务库: {store.path}）")
         
-        for i, json_file in enumerate(json_files, 1):
-            print(f"\n========== 进度: {i}/{total} ==========")
-            result = self.process_json_file(json_file, save_dir)
-            if result:
-                success_count += 1
-            
-        # 计算真正下载的数量
-        download_count = success_count - self.skip_count
+        success_count = self.process_jobs(((f, save_dir) for f in pending), len(pending))
+        counts = store.counts(save_dir)
         
         # 输出统计
         print(f"\n========== 完成 ==========")
         print(f"总计: {total} 个文件")
-        print(f"成功: {success_count} 个")
-        print(f"  - 已存在(跳过): {self.skip_count} 个")
-        print(f"  - 新下载: {download_count} 个")
-        print(f"失败: {total - success_count} 个")
+        print(f"本次处理: {len(pending)} 个，成功 {success_count} 个")
+        print(f"已完成: {counts.get('done', 0)} 个")
+        print(f"失败: {counts.get('failed', 0)} 个（包括校验失败，尝试少于 {MAX_ATTEMPTS} 次的下次运行会重试）")
+        print(f"不再重试: {counts.get('gone', 0)} 个（视频不存在或 JSON 无效）")
         print(f"视频保存在: {abs_save_dir}")
         
-        # 保存失败记录
-        if self.failed_downloads:
-            failed_file = os.path.join(save_dir, 'failed_downloads.json')
-            with open(failed_file, 'w', encoding='utf-8') as f:
-                json.dump(self.failed_downloads, f, ensure_ascii=False, indent=2)
-            print(f"\n失败记录已保存到: {failed_file}")
-            
-            # 打印失败摘要
+        # 失败记录保存在任务库中，打印失败摘要
+        summary = store.failure_summary(save_dir)
+        if summary:
             print("\n失败摘要:")
-            error_counts = {}
-            for fail in self.failed_downloads:
-                reason = fail.get('reason', '未知原因')
-                error_counts[reason] = error_counts.get(reason, 0) + 1
-            
-            for reason, count in sorted(error_counts.items(), key=lambda x: x[1], reverse=True):
+            for reason, count in summary:
                 print(f"  - {reason}: {count} 个")
 
 def main():
     # 创建下载器（不需要 bearer_token，因为使用 Playwright）
     downloader = IwaraBatchDownloader()
+    try:
+        run(downloader)
+    finally:
+        downloader.close()
+
+def run(downloader):
     
     # 默认下载目录
     save_dir = 'downloads'
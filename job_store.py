@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+下载任务状态库 - 基于 SQLite 的任务表
+每个视频 JSON 一行，记录视频ID、状态、尝试次数、最后的错误、下载的质量、文件大小和哈希
+下载器在每个阶段更新状态，崩溃不会丢失失败记录；重启后用一次索引查询得到待处理任务，不需要逐个检查文件
+登记任务时顺便从 JSON 中取出文件大小、观看数和发布时间，之后按 QUEUE_ORDERS 排序不需要再打开 JSON
+
+状态：
+    pending      待处理
+    claimed      已被 batch_download.py 的工作进程领取
+    resolving    正在解析下载地址
+    downloading  正在下载
+    verifying    下载完成，正在校验（verify_videos.py）
+    done         已完成
+    failed       失败（尝试次数未达到 MAX_ATTEMPTS 时下次运行会重试）
+    gone         视频不存在、已删除或 JSON 无效，不再重试
+
+iwara_batch_downloader.py 处理目录时使用 <保存目录>/download_jobs.sqlite，
+batch_download.py 的所有工作进程共用一个任务库：
+
+    from job_store import JobStore
+    with JobStore('download_jobs.sqlite') as store:
+        store.enqueue(json_files, save_dir)
+        store.prioritize('smallest')
+        for json_path in store.pending(save_dir):
+            ...
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+JOB_STORE_FILE = 'download_jobs.sqlite'  # 处理目录时任务库在保存目录中的文件名
+MAX_ATTEMPTS = 3  # 失败任务的最多尝试次数
+ACTIVE_STATES = ('claimed', 'resolving', 'downloading', 'verifying')
+# claim() 可以领取的任务：待处理的和可重试的失败任务
+CLAIMABLE = "(state = 'pending' OR (state = 'failed' AND attempts < ?))"
+METADATA_COLUMNS = {'quality': 'TEXT', 'file_size': 'INTEGER', 'views': 'INTEGER', 'created': 'TEXT'}
+
+def video_file_path(json_path: str, save_dir: str) -> str:
+    """视频文件与 JSON 文件同名（.json 换成 .mp4）"""
+    base_name = os.path.splitext(os.path.basename(json_path))[0]
+    return os.path.join(save_dir, f"{base_name}.mp4")
+
+def _as_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def read_job_metadata(json_path: str) -> Tuple[Optional[str], Optional[int], Optional[int], Optional[str]]:
+    """从视频 JSON 中取出 (视频ID, 文件大小, 观看数, 发布时间)，读取失败时全部为 None"""
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None, None, None, None
+    if not isinstance(data, dict):
+        return None, None, None, None
+    file_info = data.get('file') if isinstance(data.get('file'), dict) else {}
+    created = data.get('createdAt')
+    return (data.get('id'), _as_int(file_info.get('size')), _as_int(data.get('numViews')),
+            created if isinstance(created, str) else None)
+
+def _size_key(row):
+    return (row[1] is None, row[1] or 0)
+
+def _interleave_sizes(rows):
+    """大小文件交替：最大、最小、第二大、第二小……让大文件占用连接时小文件也在推进"""
+    rows = sorted(rows, key=_size_key)
+    known = [row for row in rows if row[1] is not None]
+    unknown = [row for row in rows if row[1] is None]
+    ordered = []
+    low, high = 0, len(known) - 1
+    while low <= high:
+        ordered.append(known[high])
+        high -= 1
+        if low <= high:
+            ordered.append(known[low])
+            low += 1
+    return ordered + unknown
+
+# 队列排序方式：名称 -> 对 [(json文件, 文件大小, 观看数, 发布时间)] 排序的函数，None 为按文件名（默认）
+# 没有对应元数据的任务排在最后
+QUEUE_ORDERS = {
+    'name': None,
+    'smallest': lambda rows: sorted(rows, key=_size_key),
+    'popular': lambda rows: sorted(rows, key=lambda row: (row[2] is None, -(row[2] or 0))),
+    'newest': lambda rows: sorted(rows, key=lambda row: row[3] or '', reverse=True),
+    'oldest': lambda rows: sorted(rows, key=lambda row: (row[3] is None, row[3] or '')),
+    'mixed': _interleave_sizes,
+}
+
+def is_complete_file(mp4_path: str, expected_size: Optional[int]) -> bool:
+    """
+    文件大小与元数据 file.size 一致且没有 .aria2 / .segments 进度文件
+    大小未知时无法判断（wget/curl 中断留下的文件也没有进度文件），视为未完成
+    """
+    return (bool(expected_size) and os.path.exists(mp4_path)
+            and os.path.getsize(mp4_path) == expected_size
+            and not os.path.exists(mp4_path + '.aria2')
+            and not os.path.exists(mp4_path + '.segments'))
+
+class JobStore:
+    """下载任务表（线程安全，多个进程可以同时使用同一个文件）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            json_path TEXT PRIMARY KEY,
+            video_id TEXT,
+            month TEXT NOT NULL DEFAULT '',
+            save_dir TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            quality TEXT,
+            file_size INTEGER,
+            views INTEGER,
+            created TEXT,
+            priority INTEGER,
+            bytes INTEGER,
+            sha256 TEXT,
+            worker INTEGER,
+            updated REAL
+        )''')
+        # 旧版本的任务库缺少后来加入的列
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(jobs)')}
+        for column, column_type in dict(METADATA_COLUMNS, priority='INTEGER').items():
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, month)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_save_dir ON jobs (save_dir, state)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_priority ON jobs (state, priority)')
+        self.lock = threading.Lock()
+        if 'views' not in columns:
+            self._backfill_metadata()
+
+    def _backfill_metadata(self):
+        """旧任务库升级时为未完成的任务补上排序用的元数据（只执行一次）"""
+        with self.lock:
+            rows = self.conn.execute("SELECT json_path FROM jobs WHERE state NOT IN ('done', 'gone')").fetchall()
+            self.conn.execute('BEGIN')
+            try:
+                for (json_path,) in rows:
+                    video_id, file_size, views, created = read_job_metadata(json_path)
+                    self.conn.execute(
+                        'UPDATE jobs SET video_id = COALESCE(video_id, ?), file_size = ?, views = ?, created = ? '
+                        'WHERE json_path = ?',
+                        (video_id, file_size, views, created, json_path)
+                    )
+            finally:
+                self.conn.execute('COMMIT')
+
+    def enqueue(self, json_paths: Iterable[str], save_dir: str, month: str = '') -> int:
+        """
+        登记任务，已存在的任务保持原状态；返回新登记的数量
+        新任务读取一次 JSON，记录排序用的文件大小、观看数和发布时间；
+        对应的视频文件已经存在且大小与 file.size 一致时（任务表建立前下载的）直接标记为完成，
+        大小未知或不一致的文件当作未完成，重新下载
+        """
+        added = 0
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                for json_path in json_paths:
+                    cursor = self.conn.execute(
+                        'INSERT OR IGNORE INTO jobs (json_path, month, save_dir, updated) VALUES (?, ?, ?, ?)',
+                        (json_path, month, save_dir, time.time())
+                    )
+                    if cursor.rowcount != 1:
+                        continue
+                    added += 1
+                    # 只有新任务才检查文件，已登记的任务以任务表为准
+                    video_id, file_size, views, created = read_job_metadata(json_path)
+                    self.conn.execute(
+                        'UPDATE jobs SET video_id = ?, file_size = ?, views = ?, created = ? WHERE json_path = ?',
+                        (video_id, file_size, views, created, json_path)
+                    )
+                    mp4_path = video_file_path(json_path, save_dir)
+                    if is_complete_file(mp4_path, file_size):
+                        self.conn.execute("UPDATE jobs SET state = 'done', bytes = ? WHERE json_path = ?",
+                                          (file_size, json_path))
+            finally:
+                self.conn.execute('COMMIT')
+        return added
+
+    def prioritize(self, order: str = 'name', save_dir: Optional[str] = None) -> int:
+        """
+        按 QUEUE_ORDERS 中的排序方式为未完成的任务重新编号，pending() 和 claim() 按该顺序返回任务
+        只使用登记时记录的元数据，不读取 JSON；返回排序的任务数
+        """
+        if order not in QUEUE_ORDERS:
+            raise ValueError(f"未知的排序方式: {order}（可选: {', '.join(QUEUE_ORDERS)}）")
+        query = ("SELECT json_path, file_size, views, created FROM jobs WHERE state NOT IN ('done', 'gone')")
+        params = ()
+        if save_dir is not None:
+            query += ' AND save_dir = ?'
+            params = (save_dir,)
+        with self.lock:
+            rows = self.conn.execute(query + ' ORDER BY json_path', params).fetchall()
+            sort = QUEUE_ORDERS[order]
+            updates = ([(None, row[0]) for row in rows] if sort is None
+                       else [(priority, row[0]) for priority, row in enumerate(sort(rows))])
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.executemany('UPDATE jobs SET priority = ? WHERE json_path = ?', updates)
+            finally:
+                self.conn.execute('COMMIT')
+        return len(rows)
+
+    def pending(self, save_dir: str) -> List[str]:
+        """某个保存目录中需要处理的任务（待处理、上次中断的、可重试的失败任务），按 prioritize() 的顺序"""
+        states = ('pending',) + ACTIVE_STATES
+        placeholders = ', '.join('?' * len(states))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT json_path FROM jobs WHERE save_dir = ? AND (state IN ({placeholders}) "
+                "OR (state = 'failed' AND attempts < ?)) ORDER BY priority IS NULL, priority, json_path",
+                (save_dir, *states, MAX_ATTEMPTS)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def unverified(self, save_dir: str) -> List[tuple]:
+        """已完成但还没有校验（没有哈希）的任务，返回 [(json文件, 质量)]"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT json_path, quality FROM jobs WHERE save_dir = ? AND state = 'done' AND sha256 IS NULL "
+                "ORDER BY json_path",
+                (save_dir,)
+            ).fetchall()
+
+    def claim(self, worker: int) -> Optional[tuple]:
+        """领取一个任务（按 prioritize() 的顺序，未排序时新月份优先），返回 (json文件, 保存目录)，没有任务时返回 None"""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute(
+                    f"SELECT json_path, save_dir FROM jobs WHERE {CLAIMABLE} "
+                    "ORDER BY priority IS NULL, priority, month DESC, json_path LIMIT 1",
+                    (MAX_ATTEMPTS,)
+                ).fetchone()
+                if row:
+                    self.conn.execute(
+                        "UPDATE jobs SET state = 'claimed', worker = ?, updated = ? WHERE json_path = ?",
+                        (worker, time.time(), row[0])
+                    )
+            finally:
+                self.conn.execute('COMMIT')
+        return row
+
+    def claimable(self) -> int:
+        """claim() 还能领取的任务数量"""
+        with self.lock:
+            return self.conn.execute(f'SELECT COUNT(*) FROM jobs WHERE {CLAIMABLE}', (MAX_ATTEMPTS,)).fetchone()[0]
+
+    def iter_claims(self, worker: int):
+        """不断领取任务直到队列为空"""
+        while True:
+            job = self.claim(worker)
+            if job is None:
+                return
+            yield job
+
+    def state(self, json_path: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute('SELECT state FROM jobs WHERE json_path = ?', (json_path,)).fetchone()
+        return row[0] if row else None
+
+    def start(self, json_path: str, video_id: str):
+        """开始处理一个任务（解析阶段），尝试次数加一"""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET state = 'resolving', video_id = ?, attempts = attempts + 1, updated = ? "
+                "WHERE json_path = ?",
+                (video_id, time.time(), json_path)
+            )
+
+    def set_state(self, json_path: str, state: str, quality: Optional[str] = None):
+        with self.lock:
+            self.conn.execute('UPDATE jobs SET state = ?, quality = COALESCE(?, quality), updated = ? WHERE json_path = ?',
+                              (state, quality, time.time(), json_path))
+
+    def finish(self, json_path: str, size: int, sha256: Optional[str] = None):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET state = 'done', bytes = ?, sha256 = ?, last_error = NULL, updated = ? "
+                "WHERE json_path = ?",
+                (size, sha256, time.time(), json_path)
+            )
+
+    def fail(self, json_path: str, error: str, permanent: bool = False):
+        """记录失败；permanent 表示视频不存在等无需重试的情况"""
+        with self.lock:
+            self.conn.execute(
+                'UPDATE jobs SET state = ?, last_error = ?, updated = ? WHERE json_path = ?',
+                ('gone' if permanent else 'failed', error, time.time(), json_path)
+            )
+
+    def release(self, worker: Optional[int] = None) -> int:
+        """把进行中的任务放回队列（进程崩溃或上次运行中断时）；返回放回的数量"""
+        placeholders = ', '.join('?' * len(ACTIVE_STATES))
+        with self.lock:
+            if worker is None:
+                cursor = self.conn.execute(
+                    f"UPDATE jobs SET state = 'pending', worker = NULL WHERE state IN ({placeholders})",
+                    ACTIVE_STATES
+                )
+            else:
+                cursor = self.conn.execute(
+                    f"UPDATE jobs SET state = 'pending', worker = NULL WHERE state IN ({placeholders}) AND worker = ?",
+                    (*ACTIVE_STATES, worker)
+                )
+            return cursor.rowcount
+
+    def counts(self, save_dir: Optional[str] = None) -> dict:
+        with self.lock:
+            if save_dir is None:
+                rows = self.conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+            else:
+                rows = self.conn.execute('SELECT state, COUNT(*) FROM jobs WHERE save_dir = ? GROUP BY state',
+                                         (save_dir,)).fetchall()
+        return dict(rows)
+
+    def failure_summary(self, save_dir: Optional[str] = None) -> List[tuple]:
+        """按错误原因统计失败任务，返回 [(原因, 数量)]"""
+        query = "SELECT COALESCE(last_error, '未知原因'), COUNT(*) FROM jobs WHERE state IN ('failed', 'gone')"
+        params = ()
+        if save_dir is not None:
+            query += ' AND save_dir = ?'
+            params = (save_dir,)
+        with self.lock:
+            return self.conn.execute(query + ' GROUP BY 1 ORDER BY 2 DESC', params).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+下载镜像健康度 - 在 hime / mikoto 等文件服务器之间选择和切换
+不单独探测服务器，只根据实际下载中的首字节延迟、吞吐量和错误率打分（指数滑动平均）
+连续出错的镜像暂时停用一段时间（按错误次数加倍），所有镜像都停用时选择最先恢复的一个
+
+iwara_batch_downloader.py 的分段下载器每个分段都重新选择镜像，某个镜像中途失效时剩余分段自动改用其它镜像：
+
+    health = MirrorHealth(['hime.iwara.tv', 'mikoto.iwara.tv'])
+    urls = health.candidates(download_url)
+    url = health.pick(urls)
+    health.record_success(url, latency, nbytes, seconds)  # 或 health.record_error(url)
+"""
+
+import threading
+import time
+from typing import Iterable, List, Optional
+from urllib.parse import urlparse
+
+EWMA_ALPHA = 0.3  # 新样本的权重
+COOLDOWN_BASE = 10  # 第一次停用的秒数
+COOLDOWN_MAX = 600  # 最长停用秒数
+STALE_AFTER = 120  # 超过该秒数没有样本的镜像重新视为未知，给它重新被选中的机会
+
+class MirrorStats:
+    """单个镜像的统计"""
+
+    def __init__(self):
+        self.latency = None  # 首字节延迟（秒）
+        self.throughput = None  # 吞吐量（字节/秒）
+        self.error_rate = 0.0
+        self.consecutive_errors = 0
+        self.down_until = 0.0
+        self.last_sample = 0.0
+
+    def update(self, value_name, sample):
+        old = getattr(self, value_name)
+        setattr(self, value_name, sample if old is None else old + EWMA_ALPHA * (sample - old))
+
+class MirrorHealth:
+    """同一文件在多个镜像上的 URL 之间按健康度选择（线程安全）"""
+
+    def __init__(self, hosts: Iterable[str], segment_size: int = 8 * 1024 * 1024):
+        self.hosts = list(hosts)
+        self.segment_size = segment_size
+        self.stats = {host: MirrorStats() for host in self.hosts}
+        self.lock = threading.Lock()
+
+    def candidates(self, url: str) -> List[str]:
+        """返回该文件在所有镜像上的 URL（原 URL 在前）；不是镜像域名时只返回原 URL"""
+        parsed = urlparse(url)
+        if parsed.hostname not in self.stats:
+            return [url]
+        others = [parsed._replace(netloc=parsed.netloc.replace(parsed.hostname, host)).geturl()
+                  for host in self.hosts if host != parsed.hostname]
+        return [url] + others
+
+    def _score(self, stats: MirrorStats, now: float) -> float:
+        """
+        预计下载一个分段需要的秒数，按错误率放大；越小越好
+        没有样本或样本已过时的镜像为 0（优先尝试），最近只有失败的镜像排在最后
+        """
+        if now - stats.last_sample > STALE_AFTER:
+            return 0.0
+        if stats.latency is None or stats.throughput is None:
+            return 0.0 if stats.error_rate == 0 else float('inf')
+        seconds = stats.latency + self.segment_size / max(stats.throughput, 1.0)
+        return seconds / max(0.05, 1.0 - stats.error_rate)
+
+    def pick(self, urls: List[str], exclude: Optional[str] = None) -> str:
+        """
+        从 candidates() 返回的 URL 中选择当前最好的镜像
+        exclude 为刚刚失败的 URL，有其它可用镜像时避开
+        """
+        if len(urls) == 1:
+            return urls[0]
+        now = time.time()
+        with self.lock:
+            entries = [(url, self.stats[urlparse(url).hostname]) for url in urls]
+            available = [(url, stats) for url, stats in entries if stats.down_until <= now]
+            if not available:
+                # 全部停用时选择最先恢复的镜像
+                return min(entries, key=lambda entry: entry[1].down_until)[0]
+            if exclude is not None and len(available) > 1:
+                available = [entry for entry in available if entry[0] != exclude] or available
+            return min(available, key=lambda entry: self._score(entry[1], now))[0]
+
+    def wait_time(self, urls: List[str]) -> float:
+        """所有镜像都停用时距离最早恢复还有多少秒，否则返回 0"""
+        now = time.time()
+        with self.lock:
+            stats = [self.stats[urlparse(url).hostname] for url in urls if urlparse(url).hostname in self.stats]
+            if len(stats) < len(urls):
+                return 0.0
+            return max(0.0, min(s.down_until for s in stats) - now)
+
+    def record_success(self, url: str, latency: float, nbytes: int, seconds: float):
+        """记录一次成功的请求：latency 为首字节延迟，nbytes/seconds 为传输的数据量和耗时"""
+        stats = self.stats.get(urlparse(url).hostname)
+        if stats is None:
+            return
+        with self.lock:
+            stats.update('latency', latency)
+            if nbytes and seconds > 0:
+                stats.update('throughput', nbytes / seconds)
+            stats.update('error_rate', 0.0)
+            stats.consecutive_errors = 0
+            stats.down_until = 0.0
+            stats.last_sample = time.time()
+
+    def record_error(self, url: str):
+        """
+        记录一次镜像故障（超时、连接错误、5xx），连续失败的镜像停用一段时间
+        签名链接失效（401/403/404/410）不是镜像的问题，调用方不应记录
+        """
+        host = urlparse(url).hostname
+        stats = self.stats.get(host)
+        if stats is None:
+            return
+        with self.lock:
+            stats.update('error_rate', 1.0)
+            stats.consecutive_errors += 1
+            stats.last_sample = time.time()
+            if stats.consecutive_errors >= 2:
+                cooldown = min(COOLDOWN_MAX, COOLDOWN_BASE * 2 ** (stats.consecutive_errors - 2))
+                if stats.down_until <= time.time():
+                    print(f"[镜像] {host} 连续失败 {stats.consecutive_errors} 次，停用 {cooldown} 秒")
+                stats.down_until = time.time() + cooldown
+
+    def summary(self) -> str:
+        now = time.time()
+        parts = []
+        with self.lock:
+            for host, stats in self.stats.items():
+                if stats.down_until > now:
+                    parts.append(f"{host}: 停用")
+                elif stats.throughput is None:
+                    parts.append(f"{host}: 未知")
+                else:
+                    parts.append(f"{host}: {stats.throughput / 1024 / 1024:.1f} MB/s, "
+                                 f"{stats.latency * 1000:.0f} ms, 错误率 {stats.error_rate:.0%}")
+        return ' | '.join(parts)
@@ -11,6 +11,8 @@ from pathlib import Path
 from datetime import datetime
 import traceback
 
+from dedup_index import VideoIdIndex
+
 def format_size(bytes):
     """格式化文件大小"""
     if bytes is None:
@@ -178,7 +180,24 @@ def validate_separation(normal_videos, problem_videos):
     else:
         print("  ✅ 抽查通过")
 
-def process_chunk_file(input_path, normal_output_path, problem_output_path):
+def remove_duplicates(videos, id_index):
+    """用去重索引去掉之前chunk中已出现过的视频（偏移分页会让同一视频出现多次）"""
+    new_ids = set(id_index.add_many(v["id"] for v in videos if v.get("id")))
+    unique_videos = []
+    for video in videos:
+        video_id = video.get("id")
+        if video_id is None:
+            unique_videos.append(video)
+        elif video_id in new_ids:
+            unique_videos.append(video)
+            new_ids.discard(video_id)  # 同一chunk内重复的只保留第一个
+    return unique_videos
+
+def percent(count, total):
+    """百分比；chunk 中全部是重复视频时总数为 0"""
+    return count / total * 100 if total else 0.0
+
+def process_chunk_file(input_path, normal_output_path, problem_output_path, id_index=None):
     """处理单个chunk文件"""
     print(f"\n处理文件: {input_path.name}")
     
@@ -191,9 +210,15 @@ def process_chunk_file(input_path, normal_output_path, problem_output_path):
             print(f"  ⚠️  文件格式不正确，跳过")
             return None
         
-        # 分离视频
+        # 去重后分离视频
         original_videos = data["videos"]
+        duplicate_count = 0
+        if id_index is not None:
+            unique_videos = remove_duplicates(original_videos, id_index)
+            duplicate_count = len(original_videos) - len(unique_videos)
+            original_videos = unique_videos
         normal_videos, problem_videos, stats = separate_videos(original_videos)
+        stats["duplicate"] = duplicate_count
         
         # 验证分类
         validate_separation(normal_videos, problem_videos)
@@ -235,8 +260,10 @@ def process_chunk_file(input_path, normal_output_path, problem_output_path):
         # 显示统计
         print(f"  ✅ 处理完成:")
         print(f"     总视频数: {stats['total']}")
-        print(f"     正常视频: {stats['normal']} ({stats['normal']/stats['total']*100:.1f}%)")
-        print(f"     问题视频: {len(problem_videos)} ({len(problem_videos)/stats['total']*100:.1f}%)")
+        if duplicate_count:
+            print(f"     重复视频(已跳过): {duplicate_count}")
+        print(f"     正常视频: {stats['normal']} ({percent(stats['normal'], stats['total']):.1f}%)")
+        print(f"     问题视频: {len(problem_videos)} ({percent(len(problem_videos), stats['total']):.1f}%)")
         
         if stats["problem_details"]:
             print(f"     问题详情:")
@@ -299,15 +326,19 @@ def process_all_chunks(input_dir, normal_output_dir, problem_output_dir):
         "total_embed_url": 0,
         "total_no_file": 0,
         "total_zero_size": 0,
+        "total_duplicate": 0,
         "all_problem_details": {}
     }
     
+    # 跨chunk去重索引，每次处理重新建立
+    id_index = VideoIdIndex(str(normal_output_path / "video_ids.sqlite"), reset=True)
+    
     # 处理每个文件
     for chunk_file in chunk_files:
         normal_output_file = normal_output_path / chunk_file.name
         problem_output_file = problem_output_path / chunk_file.name
         
-        stats = process_chunk_file(chunk_file, normal_output_file, problem_output_file)
+        stats = process_chunk_file(chunk_file, normal_output_file, problem_output_file, id_index)
         
         if stats:
             total_stats["files_processed"] += 1
@@ -316,6 +347,7 @@ def process_all_chunks(input_dir, normal_output_dir, problem_output_dir):
             total_stats["total_embed_url"] += stats["embed_url"]
             total_stats["total_no_file"] += stats["no_file"]
             total_stats["total_zero_size"] += stats["zero_size"]
+            total_stats["total_duplicate"] += stats["duplicate"]
             
             # 合并问题详情
             for problem, count in stats["problem_details"].items():
@@ -325,6 +357,8 @@ def process_all_chunks(input_dir, normal_output_dir, problem_output_dir):
         else:
             total_stats["files_failed"] += 1
     
+    id_index.close()
+    
     # 复制其他文件
     print("\n复制其他文件...")
     for file in input_path.glob("*.json"):
@@ -352,12 +386,13 @@ def process_all_chunks(input_dir, normal_output_dir, problem_output_dir):
     
     print(f"\n  视频分类结果:")
     print(f"    总视频数: {total_stats['total_videos']:,}")
+    print(f"    🔁 重复视频(已跳过): {total_stats['total_duplicate']:,}")
     print(f"    ✅ 正常视频: {total_stats['total_normal']:,} "
-          f"({total_stats['total_normal']/total_stats['total_videos']*100:.1f}%)")
+          f"({percent(total_stats['total_normal'], total_stats['total_videos']):.1f}%)")
     
     total_problems = total_stats["total_videos"] - total_stats["total_normal"]
     print(f"    ❌ 问题视频: {total_problems:,} "
-          f"({total_problems/total_stats['total_videos']*100:.1f}%)")
+          f"({percent(total_problems, total_stats['total_videos']):.1f}%)")
     
     print(f"\n  问题类型分布:")
     print(f"    - 外链视频(embedUrl有值): {total_stats['total_embed_url']:,}")
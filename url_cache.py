@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+签名下载链接缓存 - 按视频ID保存解析结果（所有质量的链接）和链接的过期时间
+files.iwara.tv 的下载链接带有 expires 参数，在有效期内重试、换下载方式或重启进程都不需要重新解析
+剩余有效期少于 margin 的条目视为过期并删除；没有 expires 参数的结果不缓存
+
+iwara_batch_downloader.py 在解析前查询该缓存，batch_download.py 的工作进程共用同一个缓存文件：
+
+    from url_cache import SignedUrlCache
+    with SignedUrlCache('signed_url_cache.sqlite') as cache:
+        video_data = cache.get(video_id)
+        if video_data is None:
+            video_data = resolve(video_id)
+            cache.put(video_id, video_data)
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_MARGIN = 300  # 剩余有效期少于该秒数时视为过期
+
+def url_expires_at(url: str) -> Optional[float]:
+    """读取签名链接中的 expires 参数，转换为秒级时间戳；没有该参数时返回 None"""
+    value = parse_qs(urlparse(url).query).get('expires', [None])[0]
+    try:
+        expires = int(value)
+    except (TypeError, ValueError):
+        return None
+    # 毫秒时间戳转换为秒
+    return expires / 1000 if expires > 10**11 else expires
+
+class SignedUrlCache:
+    """视频ID -> 解析结果（线程安全，多个进程可以同时使用同一个文件）"""
+
+    def __init__(self, path: str, margin: float = DEFAULT_MARGIN):
+        self.path = path
+        self.margin = margin
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS signed_urls (
+            video_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires REAL NOT NULL
+        ) WITHOUT ROWID''')
+        self.lock = threading.Lock()
+        self.purge()
+
+    def get(self, video_id: str) -> Optional[dict]:
+        """返回仍然有效的解析结果，快过期的条目删除后返回 None"""
+        with self.lock:
+            row = self.conn.execute('SELECT data, expires FROM signed_urls WHERE video_id = ?',
+                                    (video_id,)).fetchone()
+            if row is None:
+                return None
+            if row[1] - time.time() < self.margin:
+                self.conn.execute('DELETE FROM signed_urls WHERE video_id = ?', (video_id,))
+                return None
+        return json.loads(row[0])
+
+    def put(self, video_id: str, video_data: dict) -> bool:
+        """缓存解析结果，过期时间取所有质量链接中最早的一个；返回是否已缓存"""
+        expiries = [url_expires_at(video['download_url']) for video in video_data.get('all_videos', [])]
+        expiries = [expires for expires in expiries if expires]
+        if not expiries or min(expiries) - time.time() < self.margin:
+            return False
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO signed_urls (video_id, data, expires) VALUES (?, ?, ?)',
+                              (video_id, json.dumps(video_data, ensure_ascii=False), min(expiries)))
+        return True
+
+    def invalidate(self, video_id: str):
+        """链接被服务器拒绝时删除缓存的条目"""
+        with self.lock:
+            self.conn.execute('DELETE FROM signed_urls WHERE video_id = ?', (video_id,))
+
+    def purge(self) -> int:
+        """删除所有快过期的条目，返回删除的数量"""
+        with self.lock:
+            cursor = self.conn.execute('DELETE FROM signed_urls WHERE expires < ?', (time.time() + self.margin,))
+        return cursor.rowcount
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM signed_urls').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
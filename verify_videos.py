@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+下载结果校验 - 检查视频文件是否完整
+- 文件大小与元数据 file.size 一致（仅原画质量）
+- MP4 结构完整：以 ftyp 开头、包含 moov 和 mdat、最后一个 box 没有超出文件末尾
+- moov/mvhd 中的时长与元数据 file.duration 一致
+- 分块读取计算 sha256（hashlib 计算时释放 GIL，多个校验线程可以并行）
+
+iwara_batch_downloader.py 下载完成后在后台线程中调用 verify_video_file，校验失败的任务重新排队
+也可以单独校验已经下载的目录，结果写入该目录的任务状态库，失败的视频下次运行下载器时重新下载：
+
+python verify_videos.py <json目录> <视频目录> [线程数]
+"""
+
+import glob
+import hashlib
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from job_store import JOB_STORE_FILE, JobStore, video_file_path
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024  # 计算哈希时每次读取的大小
+DURATION_TOLERANCE = 2.0  # 时长允许的误差（秒）
+DURATION_TOLERANCE_RATIO = 0.01  # 或时长的 1%，取较大者
+VERIFY_WORKERS = 4
+
+def read_mp4_boxes(f, file_size):
+    """
+    遍历顶层 box，只读取 box 头部；返回 [(类型, 偏移, 大小, 头部长度)]
+    box 超出文件末尾时抛出 ValueError
+    """
+    boxes = []
+    offset = 0
+    while offset < file_size:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError(f'偏移 {offset} 处的 box 头部不完整')
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        box_type = box_type.decode('latin-1')
+        if size < header_size:
+            raise ValueError(f'box {box_type!r} 大小无效: {size}')
+        if offset + size > file_size:
+            raise ValueError(f'文件被截断（box {box_type!r} 需要 {offset + size} 字节，实际 {file_size}）')
+        boxes.append((box_type, offset, size, header_size))
+        offset += size
+    return boxes
+
+def read_mp4_duration(f, moov_offset, moov_size, header_size):
+    """从 moov/mvhd 读取时长（秒），找不到时返回 None"""
+    offset = moov_offset + header_size
+    end = moov_offset + moov_size
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, box_type = struct.unpack('>I4s', f.read(8))
+        if size < 8:
+            return None
+        if box_type == b'mvhd':
+            version = f.read(4)[0]
+            if version == 1:
+                # 创建时间、修改时间各 8 字节
+                f.seek(16, os.SEEK_CUR)
+                timescale, duration = struct.unpack('>IQ', f.read(12))
+            else:
+                f.seek(8, os.SEEK_CUR)
+                timescale, duration = struct.unpack('>II', f.read(8))
+            return duration / timescale if timescale else None
+        offset += size
+    return None
+
+def hash_file(path):
+    """分块读取计算 sha256，复用同一个缓冲区"""
+    digest = hashlib.sha256()
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+def verify_video_file(path, expected_size=None, expected_duration=None, compute_hash=True):
+    """校验单个视频文件，返回 (是否通过, 失败原因, sha256)"""
+    try:
+        file_size = os.path.getsize(path)
+        if file_size == 0:
+            return False, '文件为空', None
+        if expected_size and file_size != expected_size:
+            return False, f'文件大小不符: {file_size}/{expected_size}', None
+
+        with open(path, 'rb') as f:
+            # 错误页面等非 MP4 内容在这里就会失败
+            if f.read(8)[4:8] != b'ftyp':
+                return False, '不是 MP4 文件（缺少 ftyp）', None
+            boxes = read_mp4_boxes(f, file_size)
+            types = {box[0] for box in boxes}
+            for required in ('moov', 'mdat'):
+                if required not in types:
+                    return False, f'MP4 缺少 {required}', None
+
+            if expected_duration:
+                moov = next(box for box in boxes if box[0] == 'moov')
+                duration = read_mp4_duration(f, moov[1], moov[2], moov[3])
+                if duration is None:
+                    return False, 'MP4 缺少 mvhd 时长', None
+                tolerance = max(DURATION_TOLERANCE, expected_duration * DURATION_TOLERANCE_RATIO)
+                if abs(duration - expected_duration) > tolerance:
+                    return False, f'时长不符: {duration:.1f}/{expected_duration:.1f} 秒', None
+    except ValueError as e:
+        return False, str(e), None
+    except OSError as e:
+        return False, f'读取失败: {e}', None
+
+    return True, None, hash_file(path) if compute_hash else None
+
+def expected_from_metadata(metadata, quality=None):
+    """从视频元数据中取出 (预期大小, 预期时长)；只有原画质量的大小与 file.size 对应"""
+    file_info = metadata.get('file') if isinstance(metadata, dict) else None
+    if not isinstance(file_info, dict):
+        return None, None
+    size = file_info.get('size') if quality and quality.lower() == 'source' else None
+    return size or None, file_info.get('duration') or None
+
+def verify_directory(json_dir, video_dir, workers=VERIFY_WORKERS):
+    """校验已完成但还没有哈希的视频，结果写入视频目录的任务状态库"""
+    store = JobStore(os.path.join(video_dir, JOB_STORE_FILE))
+    store.enqueue(glob.glob(os.path.join(json_dir, '*.json')), video_dir)
+    jobs = store.unverified(video_dir)
+    print(f"需要校验 {len(jobs)} 个视频（{workers} 个线程）")
+
+    def verify(job):
+        json_path, quality = job
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+        except Exception:
+            metadata = None
+        expected_size, expected_duration = expected_from_metadata(metadata, quality)
+        mp4_path = video_file_path(json_path, video_dir)
+        ok, reason, digest = verify_video_file(mp4_path, expected_size, expected_duration)
+        if ok:
+            store.finish(json_path, os.path.getsize(mp4_path), digest)
+        else:
+            store.fail(json_path, f'校验失败: {reason}')
+            print(f"  ❌ {os.path.basename(mp4_path)}: {reason}")
+        return ok
+
+    with ThreadPoolExecutor(workers) as executor:
+        results = list(executor.map(verify, jobs))
+
+    passed = sum(results)
+    print(f"\n✅ 通过: {passed} 个")
+    print(f"❌ 失败: {len(results) - passed} 个（已标记为失败，下次运行下载器时重新下载）")
+    store.close()
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] in ['-h', '--help']:
+        print("校验已下载的视频文件")
+        print("\n用法:")
+        print("  python verify_videos.py <json目录> <视频目录> [线程数]")
+        return
+
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else VERIFY_WORKERS
+    verify_directory(sys.argv[1], sys.argv[2], workers)
+
+if __name__ == "__main__":
+    main()